@@ -1,43 +1,293 @@
-import pandas as pd
 from pathlib import Path
+from html.parser import HTMLParser
 import argparse
+import concurrent.futures
+import csv
 import os
+import re
 import sys
 
 
-def convert_html_to_tsv(PhageDPO_results, output_folder):
+READ_CHUNK = 64 * 1024 # the html is parsed in chunks, and reading stops once the first table is closed
+RESULT_PREFIX = "DPO_Prediction_" # PhageDPO result folders are named DPO_Prediction_<genome>
+WHITESPACE = re.compile(r"[\r\n]+|\s{2,}") # cell text clean up of pd.read_html
+INTEGER = re.compile(r"[+-]?(\d{1,3}(,\d{3})+|\d+)")
+FLOAT = re.compile(r"[+-]?(\d{1,3}(,\d{3})+|\d+)?(\.\d*)?([eE][+-]?\d+)?")
+
+
+def convert_html_to_tsv(PhageDPO_results, output_folder, workers=1, merged=False):
     os.makedirs(output_folder, exist_ok=True)
     tsv_results = f"{output_folder}/{os.path.basename(PhageDPO_results)}"
     print(f"TSV results will be saved to: {tsv_results}")
     os.makedirs(tsv_results, exist_ok=True)
-    PhageDPO_results = Path(PhageDPO_results)
-    for item  in PhageDPO_results.iterdir():
-        if item.is_dir():
-            print(f"now processing folder {item}")
-            html_files = list(item.glob("*.html")) 
-        
-            for html_file in html_files:
-                try:
-                    # PhageDPO results are usually one table per HTML file
-                    tables = pd.read_html(html_file)
-                    if not tables:
-                        print(f"No tables found in {html_file.name}")
-                        continue
-
-                    df = tables[0]  # usually the first table is the prediction summary
-                    tsv_path = f"{tsv_results}/{item.stem + '.tsv'}"
-                    df.to_csv(tsv_path, sep="\t", index=False)
-                    print(f"Converted {html_file.name} → {os.path.basename(tsv_path)}")
-
-                except Exception as e:
-                    print(f"Error reading {html_file.name}: {e}")
-
-        
+    jobs = assign_tsv_names(Path(PhageDPO_results), tsv_results)
+
+    results = []
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(convert_folder, conversions): folder for folder, conversions in jobs}
+            for future in concurrent.futures.as_completed(futures):
+                print(f"now processing folder {futures[future]}")
+                folder_results = future.result()
+                print_results(folder_results)
+                results.extend(folder_results)
+    else:
+        for folder, conversions in jobs:
+            print(f"now processing folder {folder}")
+            folder_results = convert_folder(conversions)
+            print_results(folder_results)
+            results.extend(folder_results)
+
+    if merged:
+        merged_path = f"{output_folder}/{os.path.basename(PhageDPO_results)}_merged.tsv"
+        merge_tsvs(sorted((result["tsv"], result["genome"]) for result in results if result["rows"] is not None), merged_path)
+
+
+def assign_tsv_names(PhageDPO_results, tsv_results):
+    """
+    returns a list of (folder, list of (html file, tsv path, genome)) for the subfolders of the results folder.
+    a folder with one html file gives <folder>.tsv, a folder with several gives <folder>_<html name>.tsv
+    for each, and a number is added if a name is already taken, so no tsv is overwritten.
+    the genome is the folder name without DPO_Prediction_, for every html file of the folder
+
+    """
+    jobs, used = [], set()
+    for item in sorted(PhageDPO_results.iterdir()):
+        if not item.is_dir():
+            continue
+        html_files = sorted(item.glob("*.html"))
+        conversions = []
+        genome = genome_name(item.name)
+        for html_file in html_files:
+            stem = item.stem if len(html_files) == 1 else f"{item.stem}_{html_file.stem}"
+            name, number = stem, 1
+            while name in used:
+                number += 1
+                name = f"{stem}_{number}"
+            used.add(name)
+            conversions.append((html_file, f"{tsv_results}/{name}.tsv", genome))
+        jobs.append((item, conversions))
+    return jobs
+
+
+def convert_folder(conversions):
+    """
+    writes the first table of each html file to its tsv path. returns one result per html file
+    with its genome, the number of rows written (None if it had no table or failed) and the error, if any
+
+    """
+    results = []
+    for html_file, tsv_path, genome in conversions:
+        result = {"html": str(html_file), "tsv": tsv_path, "genome": genome, "rows": None, "error": None}
+        try:
+            table = extract_first_table(html_file)
+            if table is not None:
+                result["rows"] = write_table(table, tsv_path)
+        except Exception as e:
+            result["error"] = repr(e)
+        results.append(result)
+    return results
+
+
+def print_results(results):
+    """
+    prints the conversion result of each html file of a folder
+
+    """
+    for result in results:
+        html_name = os.path.basename(result["html"])
+        if result["error"]:
+            print(f"Error reading {html_name}: {result['error']}")
+        elif result["rows"] is None:
+            print(f"No tables found in {html_name}")
+        else:
+            print(f"Converted {html_name} → {os.path.basename(result['tsv'])}")
+
+
+class FirstTableParser(HTMLParser):
+    """
+    collects the header and body rows (cell texts) of the first <table> of an html document.
+    header rows are the rows in <thead>, or without a <thead> the all <th> rows at the top
+    (as in pd.read_html). done is set once the table is closed, the rest of the document is not needed
+
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.depth = 0
+        self.found = self.done = False
+        self.in_thead = self.had_thead = False
+        self.header, self.rows = [], []
+        self.row, self.cell, self.row_all_th = None, None, True
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if tag == "table":
+            self.depth += 1
+            self.found = True
+        elif self.depth != 1:
+            return # rows of a table nested in a cell only add their text to the cell
+        elif tag == "thead":
+            self.in_thead = True
+        elif tag == "tr":
+            self.close_row()
+            self.row, self.row_all_th = [], True
+        elif tag in ("td", "th") and self.row is not None:
+            self.close_cell()
+            self.cell = []
+            self.row_all_th = self.row_all_th and tag == "th"
+
+    def handle_endtag(self, tag):
+        if self.done:
+            return
+        if tag == "table":
+            self.depth -= 1
+            if self.depth == 0:
+                self.close_row()
+                self.done = True
+        elif self.depth != 1:
+            return
+        elif tag in ("td", "th"):
+            self.close_cell()
+        elif tag == "tr":
+            self.close_row()
+        elif tag == "thead":
+            self.close_row()
+            self.in_thead = False
+
+    def handle_data(self, data):
+        if self.cell is not None and not self.done:
+            self.cell.append(data)
+
+    def close_cell(self):
+        if self.cell is not None:
+            self.row.append(WHITESPACE.sub(" ", "".join(self.cell).strip()))
+            self.cell = None
+
+    def close_row(self):
+        if self.row is None:
+            return
+        self.close_cell()
+        if self.in_thead:
+            self.header.append(self.row)
+            self.had_thead = True
+        elif self.row_all_th and not self.rows and not self.had_thead:
+            # without a <thead>, the all <th> rows at the top are the header
+            self.header.append(self.row)
+        else:
+            self.rows.append(self.row)
+        self.row = None
+
+
+def extract_first_table(html_path):
+    """
+    stream-parses an html file until its first table is closed. returns (column names, rows),
+    or None if the file has no table
+
+    """
+    parser = FirstTableParser()
+    with open(html_path, "r", encoding="utf-8", errors="replace") as html_file:
+        for chunk in iter(lambda: html_file.read(READ_CHUNK), ""):
+            parser.feed(chunk)
+            if parser.done:
+                break
+    if not parser.done:
+        parser.close()
+    if not parser.found or not (parser.header or parser.rows):
+        return None
+    width = max(len(row) for row in parser.header + parser.rows)
+    rows = [row + [""] * (width - len(row)) for row in parser.rows]
+    return column_names(parser.header, width), rows
+
+
+def column_names(header, width):
+    """
+    column names of the header rows, like pd.read_html: numbers if there is no header,
+    "Unnamed: <i>" for an empty name, and the names of several header rows joined with a space
+
+    """
+    if not header:
+        return [str(i) for i in range(width)]
+    names = []
+    for i in range(width):
+        parts = [row[i] for row in header if i < len(row) and row[i]]
+        names.append(" ".join(dict.fromkeys(parts)) or f"Unnamed: {i}")
+    return names
+
+
+def write_table(table, tsv_path):
+    """
+    writes a table to a tsv file like DataFrame.to_csv(sep="\\t", index=False) after pd.read_html:
+    whole number columns without thousands separators, other number columns as floats
+    (e.g. 89 -> 89.0, as are whole numbers of a column with empty cells). returns the number of rows
+
+    """
+    names, rows = table
+    columns = [number_column([row[i] for row in rows]) for i in range(len(names))]
+    with open(tsv_path, "w", newline="") as tsv_file:
+        writer = csv.writer(tsv_file, delimiter="\t", lineterminator="\n")
+        writer.writerow(names)
+        writer.writerows(zip(*columns))
+    return len(rows)
+
+
+def number_column(values):
+    """
+    the values of one column as pandas writes them after reading them as numbers
+    (the values are returned as they are if the column is not numeric)
+
+    """
+    filled = [value for value in values if value]
+    if not filled:
+        return values
+    if len(filled) == len(values) and all(INTEGER.fullmatch(value) for value in filled):
+        return [str(int(value.replace(",", ""))) for value in values]
+    if all(FLOAT.fullmatch(value) and any(char.isdigit() for char in value) for value in filled):
+        return [repr(float(value.replace(",", ""))) if value else "" for value in values]
+    return values
+
+
+def genome_name(folder_name):
+    """
+    genome name of a PhageDPO result folder (folder name without the DPO_Prediction_ prefix)
+
+    """
+    return folder_name[len(RESULT_PREFIX):] if folder_name.startswith(RESULT_PREFIX) else folder_name
+
+
+def merge_tsvs(tables, merged_path):
+    """
+    writes all tsvs (a list of (tsv path, genome)) to one tsv with a Genome column in front.
+    tsvs whose columns differ from the first one are left out (with a message)
+
+    """
+    header, row_count = None, 0
+    with open(merged_path, "w", newline="") as merged_file:
+        writer = csv.writer(merged_file, delimiter="\t", lineterminator="\n")
+        for tsv_path, genome in tables:
+            with open(tsv_path, "r", newline="") as tsv_file:
+                reader = csv.reader(tsv_file, delimiter="\t")
+                columns = next(reader, None)
+                if header is None:
+                    header = columns
+                    writer.writerow(["Genome"] + header)
+                elif columns != header:
+                    print(f"Columns of {os.path.basename(tsv_path)} differ from the other tables, not added to {os.path.basename(merged_path)}")
+                    continue
+                for row in reader:
+                    writer.writerow([genome] + row)
+                    row_count += 1
+    print(f"Merged {row_count} rows of {len(tables)} tables → {merged_path}")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="conver html table produced by PhageDPO to tsv format.")
 
-    parser.add_argument("--PhageDPO_results", required= True, help="Path to the input folder containing PhageDPO results in html format.")    
+    parser.add_argument("--PhageDPO_results", required= True, help="Path to the input folder containing PhageDPO results in html format.")
     parser.add_argument("--output_folder", required= True, help="Path to the output folder where results will be saved.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of folders to convert at once in separate processes (default: 1).")
+    parser.add_argument("--merged", action="store_true", help="Also write all tables to one <output_folder>/<input folder name>_merged.tsv with a Genome column.")
     # if all 4 arguments are not provided, print help message
     if len(sys.argv) < 2:
         parser.print_help(sys.stderr)
@@ -45,4 +295,4 @@ if __name__ == "__main__":
         sys.exit(1)
     args = parser.parse_args()
 
-    convert_html_to_tsv(args.PhageDPO_results, args.output_folder)
\ No newline at end of file
+    convert_html_to_tsv(args.PhageDPO_results, args.output_folder, args.workers, args.merged)
@@ -1,4 +1,5 @@
 import pandas as pd
+import numpy as np
 from pathlib import Path
 import argparse
 import os
@@ -6,25 +7,27 @@ import sys
 
 
 PERCENTAGE_THRESHOLD = 85.0
+SCORE_COLUMN = 'model DPO Prediction (%)'
+MERGED_SUFFIX = "_merged.tsv" # html_to_tsv.py --merged writes <tsv folder>_merged.tsv next to the tsv folder
 
 
-def get_top_DPO(PhageDPO_tsv, output_folder):
-    os.makedirs(output_folder, exist_ok=True) 
+def get_top_DPO(PhageDPO_tsv, output_folder, threshold=PERCENTAGE_THRESHOLD):
+    os.makedirs(output_folder, exist_ok=True)
     top_results = f"{output_folder}/{os.path.basename(PhageDPO_tsv)}"
     print(f"Top results will be saved to: {top_results}")
     os.makedirs(top_results, exist_ok=True)
 
     PhageDPO_tsv = Path(PhageDPO_tsv)
-    for item in PhageDPO_tsv.iterdir(): 
+    for item in PhageDPO_tsv.iterdir():
         if item.is_file() and item.suffix == ".tsv":
             print(f"now processing file {item}")
             try:
                 df = pd.read_csv(item, sep="\t")
-                if 'model DPO Prediction (%)' not in df.columns:
-                    print(f"'model DPO Prediction (%)' column not found in {item.name}, skipping.")
+                if SCORE_COLUMN not in df.columns:
+                    print(f"'{SCORE_COLUMN}' column not found in {item.name}, skipping.")
                     continue
-                # get a dataframe of all rows with a score over 80%
-                high_conf_df = df[df['model DPO Prediction (%)'] > PERCENTAGE_THRESHOLD]
+                # get a dataframe of all rows with a score over the threshold
+                high_conf_df = df[df[SCORE_COLUMN] > threshold]
                 # top_df = df.loc[df['model DPO Prediction (%)'].idxmax()]  # get row with highest DPO_Score
                 top_tsv_path = f"{top_results}/{item.stem + '_top_DPO.tsv'}"
                 high_conf_df.to_csv(top_tsv_path, sep="\t", index=False)  # save as single-row DataFrame
@@ -34,11 +37,90 @@ def get_top_DPO(PhageDPO_tsv, output_folder):
                 print(f"Error processing {item.name}: {e}")
 
 
+def get_consolidated_DPO(PhageDPO_tsv, output_folder, thresholds):
+    """
+    loads the merged PhageDPO tsv of all genomes (html_to_tsv.py --merged, given directly or found
+    next to the tsv folder) and applies all thresholds at once. writes one table of the hits above
+    the lowest threshold, ranked by score, with the highest threshold each hit passes
+    (<name>_top_DPO.tsv), and the number of hits of each genome above each threshold (<name>_DPO_counts.tsv)
+
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    if os.path.isfile(PhageDPO_tsv):
+        merged_path = PhageDPO_tsv
+    else:
+        merged_path = os.path.normpath(PhageDPO_tsv) + MERGED_SUFFIX
+    name = os.path.basename(merged_path)
+    name = name[:-len(MERGED_SUFFIX)] if name.endswith(MERGED_SUFFIX) else Path(name).stem
+    if not os.path.isfile(merged_path):
+        print(f"Merged PhageDPO tsv {merged_path} not found, run html_to_tsv.py with --merged first.")
+        return
+    df = load_merged_DPO(merged_path)
+    if df is None:
+        return
+    levels = np.sort(np.unique(np.asarray(thresholds, dtype=float)))
+    # number of thresholds each score is above (scores must be above a threshold, as in get_top_DPO)
+    passed = np.searchsorted(levels, df[SCORE_COLUMN].to_numpy(dtype=float, na_value=np.nan), side="left")
+    passed[df[SCORE_COLUMN].isna().to_numpy()] = 0
+
+    hits = df[passed > 0].copy()
+    hits["Highest threshold"] = levels[passed[passed > 0] - 1]
+    hits = hits.sort_values([SCORE_COLUMN, "Genome"], ascending=[False, True], kind="stable")
+    hits.insert(0, "Rank", np.arange(1, len(hits) + 1))
+    top_path = f"{output_folder}/{name}_top_DPO.tsv"
+    hits.to_csv(top_path, sep="\t", index=False)
+
+    counts = threshold_counts(df["Genome"], passed, levels)
+    counts_path = f"{output_folder}/{name}_DPO_counts.tsv"
+    counts.to_csv(counts_path, sep="\t", index=False)
+    print(f"{len(df)} predictions of {df['Genome'].nunique()} genomes, {len(hits)} above {levels[0]:g} → {top_path}")
+    for level, total in zip(levels, counts.iloc[-1, 1:]):
+        print(f"\t> {level:g}%: {total} hits")
+    print(f"Counts per genome and threshold → {counts_path}")
+
+
+def load_merged_DPO(merged_path):
+    """
+    reads the merged PhageDPO tsv (Genome column from html_to_tsv.py, the result folder of each table)
+    with categorical genomes and protein IDs and float scores. returns None if it can not be used
+
+    """
+    try:
+        df = pd.read_csv(merged_path, sep="\t", dtype={"Genome": "string", "ID": "string"})
+    except Exception as e:
+        print(f"Error processing {os.path.basename(merged_path)}: {e}")
+        return None
+    for column in ["Genome", SCORE_COLUMN]:
+        if column not in df.columns:
+            print(f"'{column}' column not found in {os.path.basename(merged_path)}.")
+            return None
+    df[SCORE_COLUMN] = pd.to_numeric(df[SCORE_COLUMN], errors="coerce")
+    df["Genome"] = df["Genome"].astype("category")
+    if "ID" in df.columns:
+        df["ID"] = df["ID"].astype("category")
+    return df
+
+
+def threshold_counts(genomes, passed, levels):
+    """
+    table of the number of hits of each genome above each threshold, with a Total row
+
+    """
+    # hits above threshold i are those that passed more than i thresholds
+    above = pd.crosstab(genomes, passed).reindex(columns=range(len(levels) + 1), fill_value=0)
+    above = above.iloc[:, ::-1].cumsum(axis=1).iloc[:, ::-1].iloc[:, 1:]
+    above.columns = [f"> {level:g}%" for level in levels]
+    above.loc["Total"] = above.sum()
+    return above.rename_axis("Genome").reset_index()
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="find all DPO hits above a specified threshold from PhageDPO tsv results")
 
-    parser.add_argument("--PhageDPO_tsv", required= True, help="Path to the input folder containing PhageDPO results in tsv format.")    
+    parser.add_argument("--PhageDPO_tsv", required= True, help="Path to the input folder containing PhageDPO results in tsv format (with --consolidated, the <folder>_merged.tsv of html_to_tsv.py --merged next to it is read, or give the merged tsv itself).")
     parser.add_argument("--output_folder", required= True, help="Path to the output folder where results will be saved.")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[PERCENTAGE_THRESHOLD], help=f"Prediction score threshold(s) in %% (default: {PERCENTAGE_THRESHOLD}); several only with --consolidated.")
+    parser.add_argument("--consolidated", action="store_true", help="Write one ranked table of all genomes and the hit counts per threshold from the merged tsv of html_to_tsv.py --merged, instead of one tsv per genome.")
     # if all 4 arguments are not provided, print help message
     if len(sys.argv) < 2:
         parser.print_help(sys.stderr)
@@ -46,6 +128,9 @@ if __name__ == "__main__":
         sys.exit(1)
     args = parser.parse_args()
 
-    get_top_DPO(args.PhageDPO_tsv, args.output_folder)
-
-
+    if args.consolidated:
+        get_consolidated_DPO(args.PhageDPO_tsv, args.output_folder, args.thresholds)
+    elif len(args.thresholds) > 1:
+        parser.error("several --thresholds need --consolidated")
+    else:
+        get_top_DPO(args.PhageDPO_tsv, args.output_folder, args.thresholds[0])
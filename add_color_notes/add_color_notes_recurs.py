@@ -1,8 +1,12 @@
 import subprocess
+import concurrent.futures
 import os
 import argparse 
 import sys
-from Bio import SeqIO # type: ignore
+# the shared GenBank CDS scanner/patcher is in the gbk_cds_scanner folder of this repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "gbk_cds_scanner"))
+from gbk_cds_scanner import patch_cds, format_qualifier # type: ignore
+from collections import Counter
 from pathlib import Path
 
 """
@@ -41,7 +45,7 @@ COLOURS = {
 }
 
 
-def add_colour_and_notes(input_folder, prefix, output_folder):
+def add_colour_and_notes(input_folder, prefix, output_folder, workers=1, verbose=False):
     os.makedirs(output_folder, exist_ok=True)
     output_folder_results = os.path.join(output_folder, "colour_notes_added")
     os.makedirs(output_folder_results, exist_ok=True)
@@ -54,10 +58,23 @@ def add_colour_and_notes(input_folder, prefix, output_folder):
         print(f"no .gbk files found that start with {prefix} and end with .gbk in {input_folder}")
         return
     # add color and notes to gbk files and output in output dir
-    for gbk in gbk_paths: 
-        parse_gbk(gbk, output_folder_results)
-            
-        print("\n" + "*-" * 40)
+    results = []
+    if workers > 1:
+        # each file is coloured in its own process, the results are printed here as they finish
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(safe_parse_gbk, gbk, output_folder_results, verbose): gbk for gbk in gbk_paths}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as error: # the worker process itself died
+                    result = failed_result(futures[future], error)
+                results.append(result)
+                print_gbk_result(results[-1], f"[{len(results)}/{len(gbk_paths)}] ", verbose)
+    else:
+        for gbk in gbk_paths: 
+            results.append(safe_parse_gbk(gbk, output_folder_results, verbose))
+            print_gbk_result(results[-1], f"[{len(results)}/{len(gbk_paths)}] ", verbose)
+    print_function_report(results)
 
 
 def find_gbk_paths(root, prefix):
@@ -80,35 +97,133 @@ def find_gbk_paths(root, prefix):
     return rec
 
 
-def parse_gbk(gbk_path, output_folder_results): 
-    # read the records from the gbk file if found 
-    records, list_funcs = [], []
-    file = os.path.basename(gbk_path)
-    with open(gbk_path, "r") as f: 
-        # use bio to read each CDS for a product and interpro product qualifier
-        for record in SeqIO.parse(f, "genbank"):
-            for feature in record.features:
-                if feature.type == "CDS":
-                    if "function" in feature.qualifiers: 
-                        ordered_qualifiers, curr_func = order_color_gbk_quals(feature)
-                        feature.qualifiers = ordered_qualifiers
-                        list_funcs.append(curr_func) # for checking all func types if missed one 
-            records.append(record)
+def parse_gbk(gbk_path, output_folder_results, verbose=False): 
+    """
+    writes the coloured copy of one .gbk file. returns the file name, the number of CDS of each 
+    function type (for checking all func types if missed one) and, if verbose, the NOTE messages 
+    of the CDS that already had notes. runs in a worker process with --workers, so nothing is printed here
 
+    """
+    list_funcs = [] 
+    notes = [] if verbose else None
+    file = os.path.basename(gbk_path)
     new_file = file.replace("_NEW", "_colour") if "_NEW" in file else file.replace(".gbk", "_colour.gbk")
-    SeqIO.write(records, f"{output_folder_results}/{new_file}", "genbank")       
+    # only the qualifiers of CDS with a function are rewritten, every other line is copied as it is
+    patch_cds(gbk_path, f"{output_folder_results}/{new_file}", lambda blocks: order_colour_qualifier_blocks(blocks, list_funcs, notes))
+    return {"file": file, "funcs": Counter(list_funcs), "messages": notes or [], "error": None}
+
+
+def safe_parse_gbk(gbk_path, output_folder_results, verbose=False):
+    """
+    parse_gbk, but an error (e.g. a malformed .gbk) is returned in the result (result["error"]) 
+    instead of raised, so one file can not stop the batch
 
-    list_funcs_set = list(set(list_funcs))
-    print("")
-    print(f"Finished Processing: {file}\n")
-    for item in list_funcs_set: print(item)     
+    """
+    try:
+        return parse_gbk(gbk_path, output_folder_results, verbose)
+    except Exception as error:
+        return failed_result(gbk_path, error)
+
+
+def failed_result(gbk_path, error):
+    """
+    result of a file that could not be coloured
+
+    """
+    return {"file": os.path.basename(gbk_path), "funcs": Counter(), "messages": [], "error": f"{type(error).__name__}: {error}"}
+
+
+def print_gbk_result(result, progress="", verbose=False):
+    """
+    prints one finished file, with its NOTE messages and function types if verbose (or its error)
+
+    """
+    if result.get("error"):
+        print(f"{progress}Error while processing {result['file']}: {result['error']}")
+        return
+    if verbose and result["messages"]:
+        print("\n".join(result["messages"]) + "\n")
+    print(f"{progress}Finished Processing: {result['file']} ({sum(result['funcs'].values())} CDS with a function)")
+    if verbose:
+        print("")
+        for item in result["funcs"]: print(item)
+        print("\n" + "*-" * 40)
+
+
+def print_function_report(results):
+    """
+    prints the function types of all files merged: the number of CDS and files of each, the 
+    function values that are not in COLOURS (their CDS got a note but no colour) and the files that failed
+
+    """
+    failed = sorted(result["file"] for result in results if result.get("error"))
+    results = [result for result in results if not result.get("error")]
+    cds_counts, file_counts = Counter(), Counter()
+    for result in results:
+        cds_counts.update(result["funcs"])
+        file_counts.update(result["funcs"].keys())
+    print("\n" + "*-" * 40)
+    print(f"\nFunction types in {len(results)} files:")
+    for func, count in cds_counts.most_common():
+        print(f"\t{func}: {count} CDS in {file_counts[func]} files")
+    unmapped = [func for func in cds_counts if func not in COLOURS]
+    if unmapped:
+        print(f"\n[warn] {len(unmapped)} function types are not in COLOURS, their CDS have no /colour:")
+        for func in sorted(unmapped, key=lambda func: -cds_counts[func]):
+            print(f"\t{func}: {cds_counts[func]} CDS in {file_counts[func]} files")
+    else:
+        print("\nAll function types are in COLOURS.")
+    if failed:
+        print(f"\n[warn] {len(failed)} files failed and were not coloured: {', '.join(failed)}")
+    print("\n" + "*-" * 40)
+
+
+def order_colour_qualifier_blocks(blocks, list_funcs, notes=None, colours=COLOURS):
+    """
+    same as order_color_gbk_quals, for the qualifier blocks of a CDS given by patch_cds 
+    (shared by add_colour_notes.py and add_color_notes_recurs.py): the note (existing notes + 
+    function values) and colour (from colours) qualifiers are put after the function qualifier, 
+    and every other qualifier keeps its original lines. the function type is added to list_funcs, 
+    and a NOTE message to notes (if given) when the CDS already had notes. 
+    returns None (CDS left as it is) if the CDS has no function qualifier
+
+    """
+    func_values = [value for name, value, _ in blocks if name == "function"]
+    if not func_values:
+        return None
+    note_blocks = [block for block in blocks if block[0] == "note"]
+    note_vals = [value for _, value, _ in note_blocks]
+    if note_vals and notes is not None: notes.append(f"NOTE: {note_vals}")
+    colour = None
+    if func_values[0] in colours: # assign color value based on function
+        colour = ("colour", str(colours[func_values[0]]), format_qualifier("colour", colours[func_values[0]], quote=False))
+    new_blocks, seen_function = [], False
+    for block in blocks:
+        name = block[0]
+        if name == "function" and not seen_function:
+            # all function qualifiers, then the notes and colour, as order_color_gbk_quals orders them
+            seen_function = True
+            new_blocks.extend(b for b in blocks if b[0] == "function")
+            new_blocks.extend(note_blocks)
+            new_blocks.extend(("note", v, format_qualifier("note", v)) for v in func_values if v not in note_vals)
+            if colour and colour not in new_blocks:
+                new_blocks.append(colour)
+        elif name == "colour" and colour:
+            if not seen_function and colour not in new_blocks:
+                new_blocks.append(colour) # an existing colour before the function gets the new value in place
+        elif name not in ("function", "note"): # function and note are handled at the first function qualifier
+            new_blocks.append(block)
+    list_funcs.append(func_values[0]) # to list all function types
+    return new_blocks
 
 
-def order_color_gbk_quals(feature): 
+def order_color_gbk_quals(feature, notes=None): 
     """
     orders the .gbk qualifiers, adds a note that is the same 
     as function (or adds onto existing note), adds a colour based on 
-    static color dict, and outputs as a dictionary 
+    static color dict, and outputs as a dictionary (for Biopython features, 
+    used by post_annotation_pipeline.py). a NOTE message is added to notes 
+    (if given) when the feature already had notes
 
     """
     ordered_qualifiers = {}
@@ -124,7 +239,7 @@ def order_color_gbk_quals(feature):
                 func_values = [value]
             else:
                 func_values = value
-            if note_vals: print(f"NOTE: {note_vals}") 
+            if note_vals and notes is not None: notes.append(f"NOTE: {note_vals}") 
             merged = note_vals + [v for v in func_values if v not in note_vals]
             ordered_qualifiers["note"] = merged # insert the new "note" qualifier that is same as 
             # assign color value based on function
@@ -144,6 +259,8 @@ if __name__ == "__main__":
     parser.add_argument("--input_folder", required=True, help="Path to the input folder containing subdirectories with .gbk files.")
     parser.add_argument("--prefix", required=True, help="Prefix to filter the aa.fasta files (e.g. PA-, KA-, Phage-).")
     parser.add_argument("--output_folder", required=True, help="Path to the output folder where results will be saved.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of .gbk files to colour at once in separate processes (default: 1).")
+    parser.add_argument("--verbose", action="store_true", help="Print the NOTE lines of CDS that already have notes and the function types of each file.")
     # if all arguments are not provided, print help message
     if len(sys.argv) < 2:
         parser.print_help(sys.stderr)
@@ -151,4 +268,4 @@ if __name__ == "__main__":
         sys.exit(1)
     args = parser.parse_args()
 
-    add_colour_and_notes(args.input_folder, args.prefix, args.output_folder)
\ No newline at end of file
+    add_colour_and_notes(args.input_folder, args.prefix, args.output_folder, args.workers, args.verbose)
\ No newline at end of file
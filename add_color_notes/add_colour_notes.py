@@ -2,7 +2,11 @@ import subprocess
 import os
 import argparse 
 import sys
-from Bio import SeqIO # type: ignore
+# the shared GenBank CDS scanner/patcher is in the gbk_cds_scanner folder of this repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "gbk_cds_scanner"))
+from gbk_cds_scanner import patch_cds # type: ignore
+# the CDS qualifier reordering is shared with add_color_notes_recurs.py (in this folder)
+from add_color_notes_recurs import order_colour_qualifier_blocks # type: ignore
 
 """
 0 white (RGB values: 255 255 255)
@@ -54,27 +58,16 @@ def add_colour_and_notes(input_folder, prefix, output_folder):
         dir_path = os.path.join(input_folder, dir)
         # iterate through genome subdir files 
         for file in os.listdir(dir_path): 
-            list_funcs = []
+            list_funcs, notes = [], []
             if not file.startswith(prefix) or not file.endswith(".gbk"):
                 print(f"\n[skip] {file} does not start with {prefix} or is not a .gbk file")
                 continue
             print(f"\nnow processing: {file}")
             gbk_path = os.path.join(dir_path, file)
-            # read the records from the gbk file if found 
-            records = []
-            with open(gbk_path, "r") as f: 
-                # use bio to read each CDS for a product and interpro product qualifier
-                for record in SeqIO.parse(f, "genbank"):
-                    for feature in record.features:
-                        if feature.type == "CDS":
-                            if "function" in feature.qualifiers: 
-                                ordered_qualifiers, curr_func = order_gbk_qualifiers(feature)
-                                feature.qualifiers = ordered_qualifiers
-                                list_funcs.append(curr_func) # for checking all func types if missed one 
-                    records.append(record)
-
             new_file = file.replace("_NEW", "_colour") if "_NEW" in file else file.replace(".gbk", "_colour.gbk")
-            SeqIO.write(records, f"{output_folder_results}/{new_file}", "genbank")       
+            # only the qualifiers of CDS with a function are rewritten, every other line is copied as it is
+            patch_cds(gbk_path, f"{output_folder_results}/{new_file}", lambda blocks: order_colour_qualifier_blocks(blocks, list_funcs, notes, COLOURS))
+            for note in notes: print(note)
 
             list_funcs_set = list(set(list_funcs))
             for item in list_funcs_set: print(item)     
@@ -82,40 +75,6 @@ def add_colour_and_notes(input_folder, prefix, output_folder):
         print("\n" + "*-" * 40)
 
 
-def order_gbk_qualifiers(feature): 
-    """
-    orders the .gbk qualifiers, adds a note that is the same 
-    as function (or adds onto existing note), adds a colour based on 
-    static color dict, and outputs as a dictionary 
-
-    """
-    ordered_qualifiers = {}
-    curr_func = ""
-    for qualifier, value in feature.qualifiers.items():
-        if qualifier == "function": # then insert the new "note" qualifier
-            ordered_qualifiers[qualifier] = value # use same qualifier and value for function 
-            note_vals = feature.qualifiers.get("note", []) # if note already exists
-          
-            if isinstance(note_vals, str):
-                note_vals = [note_vals]
-            if isinstance(value, str):
-                func_values = [value]
-            else:
-                func_values = value
-            if note_vals: print(f"NOTE: {note_vals}") 
-            merged = note_vals + [v for v in func_values if v not in note_vals]
-            ordered_qualifiers["note"] = merged # insert the new "note" qualifier that is same as 
-            # assign color value based on function
-            if func_values[0] in COLOURS: ordered_qualifiers["colour"] = COLOURS[func_values[0]]
-            # to list all function types
-            curr_func = func_values[0]
-        elif qualifier == "note": 
-            continue # skip, handled when we hit function qualifier
-        else:                                 
-            ordered_qualifiers[qualifier] = value
-    return ordered_qualifiers, curr_func
-
-
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run interproscan on all phage aa.fasta files of a given species from SPHAE output.")
     
@@ -2,15 +2,30 @@ from Bio import SeqIO # type: ignore
 import argparse
 import os
 import sys
+import csv
 import itertools
+import bisect
+import io
+import contextlib
+import traceback
+import concurrent.futures
+from collections import Counter
+try:
+    import pandas as pd # type: ignore
+except ImportError: # pandas is only needed for the columnar top hit engine
+    pd = None
 
 MIN_EVALUE = 1e-10
 NEXT_BEST_EVALUE = 1e-15
+HYPOTHETICAL_PRODUCTS = ["hypothetical protein", "unknown function"]
 
 
-def combine_results(interpro_folder, prefix, SPHAE_folder, output_folder):
+def combine_results(interpro_folder, prefix, SPHAE_folder, output_folder, engine="stream", workers=1):
     """
     main function: combines all following functions and is called in main
+    engine selects how the top InterProScan hits are found ("stream" or "pandas")
+    with workers > 1 the genomes are processed in a pool of worker processes, 
+    and the output of each genome is printed as one block when it finishes
 
     """
     # Iterate through all subdirectories in the SPHAE folder that begin with the specified prefix
@@ -21,199 +36,279 @@ def combine_results(interpro_folder, prefix, SPHAE_folder, output_folder):
     os.makedirs(output_subfolder, exist_ok=True)  # Create output subfolder if it does not exist
 
     # Iterate through all subdirectories in the SPHAE folder
-    for folder in os.listdir(SPHAE_folder):
-
-        # check if the .gbk file is found, if not, move on to the next subdirectory
-        gbk_path = os.path.join(SPHAE_folder, folder, f"{folder}.gbk")
-        if os.path.exists(gbk_path):
-            print(f"Processing GenBank file: {gbk_path}\n")
-        else: 
-            print(f"\nGenBank file not found: {gbk_path}\n")
-            print("#@*"* 45)
-            print("#@*"* 45 + '\n')
-            continue
-
-        # find the InterProScan results for the current phage
-        interpro_path = find_interpro_path(interpro_folder, folder)
-        if interpro_path:
-            print("-" * 60)
-            print(f"Processing InterProScan results: {interpro_path}")
-        else:
-            print(f"No InterProScan results found for {folder}. Skipping.")
-            print("-"* 50)
-            continue # Skip to the next folder if no interproscan results found
-
-        # read interpro results for phage we are currently processing
-        all_lines_in_phage = read_interpro_tsv(interpro_path)
-        print(f"\nFound {len(all_lines_in_phage)} lines in InterProScan results for {folder}.\n")
-
-        # select most specific hits for each locus with the lowest e-value
-        top_interpro_hits = select_top_hits(all_lines_in_phage)
-        interpro_prod_lib = {line[0].split(":")[1]:line[5] for line in top_interpro_hits}
-        interpro_evalue_lib = {line[0].split(":")[1]:line[8] for line in top_interpro_hits}    
-
-        # create a subdirectory for each genome in the output folder if it does not exist 
-        # create the output subfolder if it does not exist
-        print("-" * 60)
-        phage_results_subfolder = os.path.join(output_subfolder, folder)
-        os.makedirs(phage_results_subfolder, exist_ok=True)
-        # changed to new.gbk for testing and comparison
-        new_gbk_path = os.path.join(phage_results_subfolder, f"{folder}_NEW.gbk")
+    folders = os.listdir(SPHAE_folder)
+    # find the InterProScan results of all genomes with one scan of the results folder
+    interpro_paths, ambiguous = index_interpro_results(interpro_folder, folders)
+    print_ambiguous_results(interpro_paths, ambiguous)
+    results = []
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(run_combine_genome, folder, interpro_paths.get(folder), SPHAE_folder, output_subfolder, engine, True): folder for folder in folders}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as error: # the worker process itself died
+                    result = {"genome": futures[future], "status": "failed", "log": f"\nError while processing {futures[future]}: {error!r}\n"}
+                print(result.pop("log"), end="", flush=True)
+                results.append(result)
+    else:
+        for folder in folders:
+            result = run_combine_genome(folder, interpro_paths.get(folder), SPHAE_folder, output_subfolder, engine)
+            result.pop("log")
+            results.append(result)
+    print_batch_summary(results)
+
+
+def run_combine_genome(folder, interpro_path, SPHAE_folder, output_subfolder, engine, capture_log=False):
+    """
+    runs combine_genome for one genome and catches any error, so one genome can not stop the batch.
+    with capture_log the printed output is returned in result["log"] instead of printed 
+    (used in the worker processes so the output stays grouped per genome)
 
-        print(f"\nProcessing folder: {folder}")
+    """
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log) if capture_log else contextlib.nullcontext():
+        try:
+            result = combine_genome(folder, interpro_path, SPHAE_folder, output_subfolder, engine)
+        except Exception:
+            print(f"\nError while processing {folder}:\n{traceback.format_exc()}")
+            print("#@*"* 45 + '\n')
+            result = {"genome": folder, "status": "failed"}
+    result["log"] = log.getvalue()
+    return result
 
-        # write to the new_gbk_path file 
-        # if the CDS is in the interpro_product_lib then edit the product and source qualifiers
-        # glean all SPHAE information by iterating through .gbk ONCE
-        all_loci, SPHAE_prod_lib, SPHAE_func_lib, just_SPHAE, interpro_hypo_SPHAE_lib, interpro_annot_SPHAE_lib, yes_interpro, yes_SPHAE, no_SPHAE, fully_hypothetical = write_newgbk(new_gbk_path, interpro_prod_lib, gbk_path)
 
-        # write to a summary text file and note how many CDS were annotated by either SPHAE/Interpro 
-        # and how many CDS remain entirely hypothetical 
-        write_summary_file(phage_results_subfolder, folder, all_loci, yes_interpro, yes_SPHAE, interpro_hypo_SPHAE_lib, just_SPHAE, interpro_annot_SPHAE_lib, fully_hypothetical)
+def combine_genome(folder, interpro_path, SPHAE_folder, output_subfolder, engine):
+    """
+    combines the SPHAE .gbk and InterProScan results (interpro_path, None if not found) 
+    of one genome folder and returns a dictionary with the status and CDS counts of the genome
 
-        # write a .tsv file that has all the top Interpro scan hits and e-values
-        write_tophits_tsv(interpro_prod_lib, interpro_evalue_lib, phage_results_subfolder, folder)
+    """
+    # check if the .gbk file is found, if not, move on to the next subdirectory
+    gbk_path = os.path.join(SPHAE_folder, folder, f"{folder}.gbk")
+    if os.path.exists(gbk_path):
+        print(f"Processing GenBank file: {gbk_path}\n")
+    else: 
+        print(f"\nGenBank file not found: {gbk_path}\n")
+        print("#@*"* 45)
+        print("#@*"* 45 + '\n')
+        return {"genome": folder, "status": "skipped (no .gbk)"}
+
+    # the InterProScan results for the current phage were found by index_interpro_results
+    if interpro_path:
+        print("-" * 60)
+        print(f"Processing InterProScan results: {interpro_path}")
+    else:
+        print(f"No InterProScan results found for {folder}. Skipping.")
+        print("-"* 50)
+        return {"genome": folder, "status": "skipped (no InterProScan .tsv)"}
+
+    # stream the interpro results for phage we are currently processing, and
+    # select most specific hits for each locus with the lowest e-value
+    if engine == "pandas":
+        line_count, interpro_prod_lib, interpro_evalue_lib = select_top_hits_columnar(interpro_path)
+    else:
+        line_count, interpro_prod_lib, interpro_evalue_lib = reduce_interpro_tsv(interpro_path)
+    print(f"\nFound {line_count} lines in InterProScan results for {folder}.\n")
+
+    # create a subdirectory for each genome in the output folder if it does not exist 
+    # create the output subfolder if it does not exist
+    print("-" * 60)
+    phage_results_subfolder = os.path.join(output_subfolder, folder)
+    os.makedirs(phage_results_subfolder, exist_ok=True)
+    # changed to new.gbk for testing and comparison
+    new_gbk_path = os.path.join(phage_results_subfolder, f"{folder}_NEW.gbk")
+
+    print(f"\nProcessing folder: {folder}")
+
+    # write to the new_gbk_path file 
+    # if the CDS is in the interpro_product_lib then edit the product and source qualifiers
+    # count the SPHAE information by iterating through .gbk ONCE, one record at a time
+    cds_counts, interpro_hypo_SPHAE_lib = write_newgbk(new_gbk_path, interpro_prod_lib, gbk_path)
+
+    # write to a summary text file and note how many CDS were annotated by either SPHAE/Interpro 
+    # and how many CDS remain entirely hypothetical 
+    write_summary_file(phage_results_subfolder, folder, cds_counts, interpro_hypo_SPHAE_lib)
+
+    # write a .tsv file that has all the top Interpro scan hits and e-values
+    write_tophits_tsv(interpro_prod_lib, interpro_evalue_lib, phage_results_subfolder, folder)
 
-        """
-        interpro_hypo_SPHAE_lib (CDS that are SPHAE hypothetical, but interpro annotated)
-        interpro_annot_SPHAE_lib (CDS that are annotated by both InterProScan and SPHAE)
-        just_SPHAE (annotated by just SPHAE)
-        fully_hypothetical (not annotated by either SPHAE or InterProScan)
+    """
+    interpro_hypo_SPHAE_lib (CDS that are SPHAE hypothetical, but interpro annotated)
+    interpro_annot_SPHAE_lib (CDS that are annotated by both InterProScan and SPHAE)
+    just_SPHAE (annotated by just SPHAE)
+    fully_hypothetical (not annotated by either SPHAE or InterProScan)
 
-        ALL CDS should fall within one of these categories. 
+    ALL CDS should fall within one of these categories. 
 
-        """
-        
-        print("\n")
-        print("-"* 120)
-        print("#@*"* 40)
-        print("#@*"* 40)
-        print("-"* 120)
-        print("\n")
+    """
+    
+    print("\n")
+    print("-"* 120)
+    print("#@*"* 40)
+    print("#@*"* 40)
+    print("-"* 120)
+    print("\n")
+    return {"genome": folder, "status": "done", "total": cds_counts["total"], "interpro": cds_counts["interpro"], "SPHAE": cds_counts["SPHAE"], 
+            "new": cds_counts["new"], "hypothetical": cds_counts["hypothetical"]}
 
 
-def select_top_hits(all_lines_in_phage): 
+def print_batch_summary(results):
     """
-    select the top interpro hit by evalue with the most specific description 
+    prints one line per genome (sorted by name) with the CDS counts, and lists the genomes that failed
 
     """
-    # remove all ambiguous hits from the unfiltered InterProScan result
-    filtered_interpro_hits = remove_ambig_hits(all_lines_in_phage)
-    # sort by locus in case out of order (use [-1] so it’s robust to extra colons)
-    filtered_interpro_hits.sort(key=lambda r: r[0].split(':')[-1])
-    # create top hits list with only hits of the highest e-value 
-    current_locus = filtered_interpro_hits[0][0].split(':')[1]
-    current_locus_hits = []
-    top_interpro_hits = []
-    for item in filtered_interpro_hits: 
-        locus = item[0].split(':')[1]
-        if locus == current_locus: # if part of the same group, append and continue 
-            current_locus_hits.append(item)
-        else: # if new group, flush the previous group 
-            # filter to find the top interpro hit for (old) current  and append to master list of top hits
-            top_interpro_hits = next_best_hit(current_locus_hits, top_interpro_hits)
-            # reset the current_locus_hits for the next locus
-            current_locus_hits = [item]
-            # change current locus to new locus (DO NOT REUSE until next iteration)"
-            current_locus = locus
-    # flush the final group
-    if current_locus_hits:
-        top_interpro_hits = next_best_hit(current_locus_hits, top_interpro_hits)
-    return top_interpro_hits
-
-
-def next_best_hit(current_locus_hits, top_interpro_hits): 
+    print("-"* 60)
+    print("Batch summary:\n")
+    print("Genome\tStatus\tTotal CDS\tInterProScan\tSPHAE\tNEW\tFully hypothetical")
+    for result in sorted(results, key=lambda r: r["genome"]):
+        counts = [str(result.get(key, "-")) for key in ["total", "interpro", "SPHAE", "new", "hypothetical"]]
+        print("\t".join([result["genome"], result["status"]] + counts))
+    failed = [result["genome"] for result in results if result["status"] == "failed"]
+    done = sum(1 for result in results if result["status"] == "done")
+    print(f"\n{len(results)} genome(s): {done} done, {len(failed)} failed, {len(results) - done - len(failed)} skipped")
+    if failed:
+        print(f"failed genomes: {', '.join(sorted(failed))}")
+
+
+def reduce_interpro_tsv(interpro_path):
     """
-    finds the top interpro hit of the lowest e value but highest specificity
+    Streams the InterProScan TSV once and folds each row straight into a per-locus 
+    best / next best accumulator (same selection as the original list based 
+    select_top_hits, kept in test_top_hits.py, without holding or sorting all rows). 
+    only the protein id, description and e-value are used.
+    returns the number of lines read and the product and e-value libraries (sorted by locus)
 
     """
-    best_hit = min(current_locus_hits, key=lambda x: float(x[8].lower()))
-    # best_hit = min(current_locus_hits, key=lambda x: float(x[8].lower().split("e")[0]) * 10 ** float(x[8].lower().split("e")[1]))
-    current_locus_hits.remove(best_hit)  # Remove the best hit from the filtered list
-    if current_locus_hits:
-        next_best_hit = min(current_locus_hits, key=lambda x: float(x[8].lower()))
-        # check if the next best hit contains the same product as the best hit, but is more specific
-        # if so, then change the best hit to the next best hit
-        # example: best hit is "GGDEF", while next best hit is "GGDEF diguanylate cyclase"
-        if best_hit[5] in next_best_hit[5] and len(best_hit[5]) < len(next_best_hit[5]): 
-            if float(next_best_hit[8].lower()) <= NEXT_BEST_EVALUE: 
-                best_hit = next_best_hit
-    top_interpro_hits.append(best_hit)
-    return top_interpro_hits
-
-
-def remove_ambig_hits(all_lines_in_phage):
+    line_count, locus_hits = 0, {}
+    with open(interpro_path, "r") as interpro_file:
+        # there is no header line in the interpro file
+        for line in interpro_file:
+            parts = line.rstrip("\n").split("\t", 9) # columns after the e-value are not needed
+            if len(parts) < 9:
+                continue
+            line_count += 1
+            product, evalue_str = parts[5], parts[8]
+            # do not keep lines that do not have a product or e-value, or with e-value greater than global min value
+            if evalue_str == "-" or product == '-':
+                continue
+            evalue = float(evalue_str)
+            if evalue > MIN_EVALUE:
+                continue
+            hit = (evalue, product, evalue_str)
+            locus = parts[0].split(":")[-1]
+            hits = locus_hits.get(locus)
+            # the first hit with the lowest e-value is the best, the first lowest of the rest is next best
+            if hits is None:
+                locus_hits[locus] = [hit, None]
+            elif evalue < hits[0][0]:
+                hits[0], hits[1] = hit, hits[0]
+            elif hits[1] is None or evalue < hits[1][0]:
+                hits[1] = hit
+    interpro_prod_lib, interpro_evalue_lib = {}, {}
+    for locus in sorted(locus_hits):
+        best_hit, next_best_hit = locus_hits[locus]
+        # if the next best hit contains the same product as the best hit, but is more specific, use it instead
+        if next_best_hit and best_hit[1] in next_best_hit[1] and len(best_hit[1]) < len(next_best_hit[1]) and next_best_hit[0] <= NEXT_BEST_EVALUE:
+            best_hit = next_best_hit
+        interpro_prod_lib[locus], interpro_evalue_lib[locus] = best_hit[1], best_hit[2]
+    return line_count, interpro_prod_lib, interpro_evalue_lib
+
+
+def select_top_hits_columnar(interpro_path):
     """
-    Remove ambiguous hits from the InterProScan results. 
+    Columnar (pandas) version of the top hit selection: reads the protein id, description 
+    and e-value columns, parses the e-values once into a float column, and picks the best 
+    and next best hit of every locus in one grouped pass (same MIN_EVALUE / NEXT_BEST_EVALUE 
+    rules and tie-breaking as reduce_interpro_tsv).
+    returns the number of lines read and the product and e-value libraries (sorted by locus)
 
     """
-    filtered_interpro_hits = []
-    for line in all_lines_in_phage: 
-        # do not keep lines that do not have a product or e-value
-        if line[8] == "-" or line[5] == '-':
-            continue
-        e_value = float(line[8].lower())
-        if e_value <= MIN_EVALUE: # do not keep hits with e-value greater than global min value
-            filtered_interpro_hits.append(line)
-    return filtered_interpro_hits
+    if pd is None:
+        sys.exit("The pandas engine needs pandas installed (pip install pandas).")
+    try:
+        hits = pd.read_csv(interpro_path, sep="\t", header=None, usecols=[0, 5, 8], dtype=str,
+                           quoting=csv.QUOTE_NONE, keep_default_na=False)
+    except pd.errors.EmptyDataError:
+        return 0, {}, {}
+    hits.columns = ["protein", "product", "evalue_str"]
+    line_count = len(hits)
+    # do not keep lines that do not have a product or e-value, or with e-value greater than global min value
+    hits = hits[~hits["evalue_str"].isin(["-", ""]) & (hits["product"] != "-")].copy()
+    hits["evalue"] = hits["evalue_str"].astype(float)
+    hits = hits[hits["evalue"] <= MIN_EVALUE]
+    hits["locus"] = hits["protein"].str.split(":").str[-1]
+    # stable sort keeps file order within equal e-values, so the first lowest hit ranks first
+    hits = hits.sort_values(["locus", "evalue"], kind="mergesort")
+    rank = hits.groupby("locus", sort=False).cumcount()
+    best = hits[rank == 0].set_index("locus")
+    next_best = hits[rank == 1].set_index("locus").reindex(best.index)
+    # if the next best hit contains the same product as the best hit, but is more specific, use it instead
+    has_next = next_best["product"].notna().to_numpy()
+    more_specific = [bool(n) and b in nb and len(b) < len(nb) for n, b, nb in zip(has_next, best["product"], next_best["product"].fillna(""))]
+    use_next = pd.Series(more_specific, index=best.index) & (next_best["evalue"] <= NEXT_BEST_EVALUE)
+    top = best[["product", "evalue_str"]].mask(use_next, next_best[["product", "evalue_str"]])
+    return line_count, dict(zip(top.index, top["product"])), dict(zip(top.index, top["evalue_str"]))
 
 
 def write_newgbk(new_gbk_path, interpro_prod_lib, gbk_path):
     """
-    Writes the records to a new GenBank file and returns 
-    libraries of SPHAE/ interpro information 
+    Writes the records to a new GenBank file one record at a time (only the current record 
+    is held in memory) and returns the CDS counts of count_cds_annotation and the library of 
+    SPHAE hypothetical CDS annotated by InterProScan (locus -> InterProScan product), 
     while iterating the genbank file only once
     
     """
-    all_loci, SPHAE_prod_lib, SPHAE_func_lib, just_SPHAE, interpro_hypo_SPHAE_lib, interpro_annot_SPHAE_lib, yes_interpro = [], {}, {}, [], {}, {}, []
-    yes_SPHAE, no_SPHAE, fully_hypothetical = [], [], []
-    records = list(SeqIO.parse(gbk_path, "genbank"))
+    cds_counts, interpro_hypo_SPHAE_lib = Counter(), {}
     with open(new_gbk_path, "w") as gbk_file:
-        for record in records: 
+        for record in SeqIO.parse(gbk_path, "genbank"): 
             for feature in record.features: # iterate through all features in gbk 
                 if feature.type == "CDS":
                     locus, SPHAE_product = feature.qualifiers.get("locus_tag", [""])[0], feature.qualifiers["product"][0].lower()
-                    all_loci, yes_SPHAE, no_SPHAE, SPHAE_prod_lib, SPHAE_func_lib = populate_SPHAE_libs(all_loci, SPHAE_product, yes_SPHAE, no_SPHAE, SPHAE_prod_lib, SPHAE_func_lib, feature, locus)
+                    count_cds_annotation(cds_counts, interpro_hypo_SPHAE_lib, interpro_prod_lib, SPHAE_product, locus)
                     if locus in interpro_prod_lib: # if there is a InterProScan hit then alter CDS
-                        populate_SPHAE_interpro_libs(interpro_prod_lib, yes_interpro, interpro_hypo_SPHAE_lib, interpro_annot_SPHAE_lib, SPHAE_product, locus)
-                        # make a new library of ordered qualifiers wiht interpro results added
-                        ordered_qualifiers = order_gbk_qualifiers(feature, interpro_prod_lib, locus)
-                        feature.qualifiers = ordered_qualifiers
-                        # add "InterProScan" as a source for the CDS
-                        if feature.qualifiers["source"][0]:
-                            feature.qualifiers["source"] = f"{feature.qualifiers['source'][0]}, InterProScan"
-                        else: feature.qualifiers["source"] = f"InterProScan"
-                    elif SPHAE_product not in ["hypothetical protein", "unknown function"]: 
-                        just_SPHAE.append(locus) # if not interpro hit, and not SPHAE hypothetical, append to just SPHAE loci
-                    else: # no interpro or SPHAE product
-                        fully_hypothetical.append(locus)
+                        add_interpro_annotation(feature, interpro_prod_lib, locus)
             SeqIO.write(record, gbk_file, "genbank") # write the current record to the new .gbk file
-    return all_loci, SPHAE_prod_lib, SPHAE_func_lib, just_SPHAE, interpro_hypo_SPHAE_lib, interpro_annot_SPHAE_lib, yes_interpro, yes_SPHAE, no_SPHAE, fully_hypothetical
+    return cds_counts, interpro_hypo_SPHAE_lib
 
 
-def populate_SPHAE_libs(all_loci, SPHAE_product, yes_SPHAE, no_SPHAE, SPHAE_prod_lib, SPHAE_func_lib, feature, locus):
+def count_cds_annotation(cds_counts, interpro_hypo_SPHAE_lib, interpro_prod_lib, SPHAE_product, locus):
     """
-    populate the SPHAE libraries 
+    counts one CDS in the SPHAE / InterProScan categories (only the counts are kept, 
+    except for the newly annotated CDS that are listed in the summary): 
+        total, SPHAE, no_SPHAE (SPHAE hypothetical), interpro, 
+        new (SPHAE hypothetical, but interpro annotated), both (annotated by both InterProScan and SPHAE), 
+        just_SPHAE (annotated by just SPHAE), hypothetical (not annotated by either SPHAE or InterProScan)
 
     """
-    all_loci.append(locus)
-    if SPHAE_product in ["hypothetical protein", "unknown function"]: no_SPHAE.append(locus)
-    else: yes_SPHAE.append(locus)
-    SPHAE_prod_lib[locus], SPHAE_func_lib[locus] = feature.qualifiers.get("product", ["hypothetical protein"])[0], feature.qualifiers.get("function", ["unknown function"])[0]
-    return all_loci, yes_SPHAE, no_SPHAE, SPHAE_prod_lib, SPHAE_func_lib
-    
-
-def populate_SPHAE_interpro_libs(interpro_prod_lib, yes_interpro, interpro_hypo_SPHAE_lib, interpro_annot_SPHAE_lib, SPHAE_product, locus): 
+    cds_counts["total"] += 1
+    SPHAE_hypothetical = SPHAE_product in HYPOTHETICAL_PRODUCTS
+    cds_counts["no_SPHAE" if SPHAE_hypothetical else "SPHAE"] += 1
+    if locus in interpro_prod_lib:
+        cds_counts["interpro"] += 1
+        # populate the SPHAE hypothetical and SPHAE annotated interpro hits 
+        if SPHAE_hypothetical:
+            cds_counts["new"] += 1
+            interpro_hypo_SPHAE_lib[locus] = interpro_prod_lib[locus]
+        else: cds_counts["both"] += 1
+    elif not SPHAE_hypothetical: # if not interpro hit, and not SPHAE hypothetical, count as just SPHAE
+        cds_counts["just_SPHAE"] += 1
+    else: # no interpro or SPHAE product
+        cds_counts["hypothetical"] += 1
+
+
+def add_interpro_annotation(feature, interpro_prod_lib, locus):
     """
-    populate the interpro / SPHAE interpro libraries 
+    adds the InterProScan product of the locus to a CDS feature (in place) 
+    and adds "InterProScan" as a source
 
     """
-    yes_interpro.append(locus)
-    # populate the SPHAE hypothetical and SPHAE annotated interpro hits 
-    if SPHAE_product in ["hypothetical protein", "unknown function"]: 
-        interpro_hypo_SPHAE_lib[locus] = interpro_prod_lib[locus]
-    else: interpro_annot_SPHAE_lib[locus] = interpro_prod_lib[locus]
-    return yes_interpro, interpro_hypo_SPHAE_lib, interpro_annot_SPHAE_lib
+    # make a new library of ordered qualifiers wiht interpro results added
+    feature.qualifiers = order_gbk_qualifiers(feature, interpro_prod_lib, locus)
+    # add "InterProScan" as a source for the CDS
+    if feature.qualifiers["source"][0]:
+        feature.qualifiers["source"] = f"{feature.qualifiers['source'][0]}, InterProScan"
+    else: feature.qualifiers["source"] = f"InterProScan"
 
 
 def order_gbk_qualifiers(feature, interpro_prod_lib, locus): 
@@ -225,7 +320,7 @@ def order_gbk_qualifiers(feature, interpro_prod_lib, locus):
     for qualifier, value in feature.qualifiers.items():
         if qualifier == "product": # insert the new "interpro_product" qualifier
             # if it is a hypothetical protein, append interpro product to existing product 
-            if value[0].lower() in ["hypothetical protein", "unknown function"]:
+            if value[0].lower() in HYPOTHETICAL_PRODUCTS:
                 ordered_qualifiers[qualifier] = [value[0] + " | " + interpro_prod_lib[locus]]
             # if it is not a hypothetical protein, just use the original product name
             else: 
@@ -251,67 +346,80 @@ def write_tophits_tsv(interpro_prod_lib, interpro_evalue_lib, phage_results_subf
             tsv_file.write(f"{hit[0]}\t{hit[1]}\t{hit[2]}\t{hit[3]}\n")
 
 
-def write_summary_file(phage_results_subfolder, folder, all_loci, yes_interpro, yes_SPHAE, interpro_hypo_SPHAE_lib, just_SPHAE, interpro_annot_SPHAE_lib, fully_hypothetical):
+def write_summary_file(phage_results_subfolder, folder, cds_counts, interpro_hypo_SPHAE_lib):
     """
     Write relevant stats to a summary .txt file
 
     """
     with open(f"{phage_results_subfolder}/{folder}_NEW_summary.txt", "w") as summary_file:
         summary_file.write(f"Summary for {folder}:\n")
-        summary_file.write(f"Total CDS: {len(all_loci)}\n")
-        summary_file.write(f"Annotated by InterProScan: {len(yes_interpro)}\n")
-        summary_file.write(f"Annotated by SPHAE: {len(yes_SPHAE)}\n")
-        summary_file.write(f"Annotated by just InterProScan (NEW): {len(interpro_hypo_SPHAE_lib)}\n")
-        summary_file.write(f"Annotated by just SPHAE: {len(just_SPHAE)}\n")
-        summary_file.write(f"Annotated by both InterProScan and SPHAE: {len(interpro_annot_SPHAE_lib)}\n")
-        summary_file.write(f"Fully hypothetical (no SPHAE or Interpro hits): {len(fully_hypothetical)}\n")
+        summary_file.write(f"Total CDS: {cds_counts['total']}\n")
+        summary_file.write(f"Annotated by InterProScan: {cds_counts['interpro']}\n")
+        summary_file.write(f"Annotated by SPHAE: {cds_counts['SPHAE']}\n")
+        summary_file.write(f"Annotated by just InterProScan (NEW): {cds_counts['new']}\n")
+        summary_file.write(f"Annotated by just SPHAE: {cds_counts['just_SPHAE']}\n")
+        summary_file.write(f"Annotated by both InterProScan and SPHAE: {cds_counts['both']}\n")
+        summary_file.write(f"Fully hypothetical (no SPHAE or Interpro hits): {cds_counts['hypothetical']}\n")
         summary_file.write("\nNewly annotated CDS:\n") 
         for loci in interpro_hypo_SPHAE_lib:
             summary_file.write(f"\t{loci} -> {interpro_hypo_SPHAE_lib[loci]}\n")
 
 
-def create_interpro_lib(interpro_hits):
+def index_interpro_results(interpro_folder, genomes):
     """
-    Creates a library of InterProScan  from a list of interpro lines.
+    Scans the InterProScan results folder once and maps each genome folder name to its .tsv file. 
+    a results subfolder belongs to a genome if its name starts with the genome name (only the 
+    subfolders that match a genome are listed). if a genome has several candidate .tsv files, the 
+    first one by this rule is used:
+        1. the subfolder name continues with a separator after the genome name (e.g. "PA-18_..." 
+           or "PA-18-predict_"), other subfolders (e.g. "PA-187_..." for genome "PA-18") 
+           are only used if no such subfolder has a .tsv
+        2. InterProScan aa.fasta output (name ends with aa.fasta.tsv)
+        3. the shortest subfolder name, then subfolder and file name in alphabetical order
+    returns the genome -> .tsv path library and a library of genome -> ignored candidate paths
 
     """
-    interpro_lib = {}
-    for line in interpro_hits:
-        locus_tag = line[0].split(":")[1]
-        interpro_lib[locus_tag] = line[5]  # Store the InterProScan product for each locus tag
-    return interpro_lib
-
-
-def find_interpro_path(interpro_folder, folder):
-    """
-    Finds the path to the InterProScan results for the given phage folder.
-    
-    """
-    interpro_path = None
-    for filename in os.listdir(interpro_folder):
-        if filename.startswith(folder) and os.path.isdir(os.path.join(interpro_folder, filename)): 
-            for file in os.listdir(os.path.join(interpro_folder, filename)):
-                if file.endswith(".tsv"):
-                    interpro_path = os.path.join(interpro_folder, filename, file)
-    return interpro_path
-
-
-def read_interpro_tsv(interpro_path):
+    with os.scandir(interpro_folder) as entries:
+        subfolders = sorted(entry.name for entry in entries if entry.is_dir())
+    interpro_paths, ambiguous, subfolder_tsvs = {}, {}, {}
+    for genome in genomes:
+        candidates = []
+        # subfolders starting with the genome name are next to each other in the sorted list
+        for subfolder in subfolders[bisect.bisect_left(subfolders, genome):]:
+            if not subfolder.startswith(genome):
+                break
+            if subfolder not in subfolder_tsvs: # each subfolder is listed at most once
+                with os.scandir(os.path.join(interpro_folder, subfolder)) as entries:
+                    subfolder_tsvs[subfolder] = [entry.name for entry in entries if entry.name.endswith(".tsv") and entry.is_file()]
+            rest = subfolder[len(genome):]
+            for tsv in subfolder_tsvs[subfolder]:
+                rank = (bool(rest) and rest[0].isalnum(), not tsv.endswith("aa.fasta.tsv"), len(subfolder), subfolder, tsv)
+                candidates.append((rank, os.path.join(interpro_folder, subfolder, tsv)))
+        if candidates:
+            candidates.sort()
+            # folders that only share the start of the name belong to other genomes, only use them if nothing else is found
+            if not candidates[0][0][0]:
+                candidates = [candidate for candidate in candidates if not candidate[0][0]]
+            interpro_paths[genome] = candidates[0][1]
+            if len(candidates) > 1:
+                ambiguous[genome] = [path for _, path in candidates[1:]]
+    return interpro_paths, ambiguous
+
+
+def print_ambiguous_results(interpro_paths, ambiguous):
     """
-    Reads the InterProScan TSV file and returns a list of lines.
+    prints the genomes that had more than one candidate InterProScan .tsv file, 
+    with the file that is used and the files that are ignored
 
     """
-    all_lines_in_phage = []
-    with open(interpro_path, "r") as interpro_file:
-        lines = interpro_file.readlines()
-        # Initialize lists for hypothetical and annotated proteins
-        # there is no header line in the interpro file
-        for line in lines:
-            parts = line.strip().split("\t")
-            all_lines_in_phage.append(parts)
-    return all_lines_in_phage
-
-
+    if not ambiguous:
+        return
+    print(f"{len(ambiguous)} genome(s) have more than one InterProScan .tsv file:\n")
+    for genome in sorted(ambiguous):
+        print(f"{genome}:\n\tusing:   {interpro_paths[genome]}")
+        for path in ambiguous[genome]:
+            print(f"\tignored: {path}")
+    print("-"* 60)
 
 
 if __name__ == "__main__":
@@ -321,6 +429,8 @@ if __name__ == "__main__":
     parser.add_argument("--prefix", required= True, help="Prefix to filter the aa.fasta files (e.g. PA-, KA-, Phage-).")
     parser.add_argument("--SPHAE_folder", required= True, help="Path to the SPHAE results folder (usually labeled 'final-annotate/' by SPHAE).")
     parser.add_argument("--output_folder", required= True, help="Path to the output folder where results will be saved.")
+    parser.add_argument("--engine", choices=["stream", "pandas"], default="stream", help="How top InterProScan hits are selected: stream the TSV line by line (default) or use pandas grouped operations.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of genomes to process at once in separate processes (default: 1).")
     # if all 4 arguments are not provided, print help message
     if len(sys.argv) < 1:
         parser.print_help(sys.stderr)
@@ -328,4 +438,4 @@ if __name__ == "__main__":
         sys.exit(1)
     args = parser.parse_args()
 
-    combine_results(args.interpro_folder, args.prefix, args.SPHAE_folder, args.output_folder)
+    combine_results(args.interpro_folder, args.prefix, args.SPHAE_folder, args.output_folder, args.engine, args.workers)
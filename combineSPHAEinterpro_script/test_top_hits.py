@@ -0,0 +1,160 @@
+import os
+import random
+import sys
+import pytest # type: ignore
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from combineSPHAEinterpro import MIN_EVALUE, NEXT_BEST_EVALUE, reduce_interpro_tsv, select_top_hits_columnar # type: ignore
+
+"""
+Checks that the streaming and pandas top hit engines give the same top InterProScan hits
+as the original select_top_hits, on random InterProScan .tsv files. the original (list based)
+selection is kept below as the reference, combineSPHAEinterpro.py no longer uses it
+
+"""
+
+# nested descriptions for the "next best hit is more specific" rule, and "-" for no description
+DESCRIPTIONS = ["GGDEF", "GGDEF diguanylate cyclase", "Portal", "Portal protein", "Tail", "Tail fiber", "AAA+ ATPase domain", "-"]
+# e-values around MIN_EVALUE and NEXT_BEST_EVALUE, above MIN_EVALUE, and "-" for no e-value
+EVALUES = ["1E-10", "2E-10", "1.1E-10", "5E-16", "1E-15", "1.0E-15", "7.05827E-24", "1E-5", "1E-100", "3.2E-42", "-"]
+TSV_COUNT = 200
+
+
+def write_random_tsv(path, rnd):
+    """
+    writes a random InterProScan .tsv: loci in random order with 0 to 8 hits each, loci with only
+    "-" or too high e-values (no hits left), and repeated e-values (ties)
+
+    """
+    lines = []
+    for i in range(rnd.randint(1, 40)):
+        locus = f"CDS_{i:04d}"
+        kind = rnd.random()
+        for _ in range(rnd.randint(0, 8)):
+            if kind < 0.15: # a locus without any usable hit
+                description, evalue = rnd.choice(DESCRIPTIONS), rnd.choice(["-", "1E-5", "2E-10"])
+            else:
+                description, evalue = rnd.choice(DESCRIPTIONS), rnd.choice(EVALUES)
+            lines.append(f"_genome:{locus}\tmd5\t100\tPfam\tPF00001\t{description}\t1\t90\t{evalue}\tT\t05-08-2025\tIPR000001\tdesc\t-\t-\n")
+    rnd.shuffle(lines)
+    # at least one usable hit, select_top_hits does not handle a file without any
+    lines.append(f"_genome:CDS_9999\tmd5\t100\tPfam\tPF00001\tPortal\t1\t90\t1E-50\tT\t05-08-2025\tIPR000001\tdesc\t-\t-\n")
+    with open(path, "w") as tsv_file:
+        tsv_file.writelines(lines)
+
+
+def read_interpro_tsv(interpro_path):
+    """
+    Reads the InterProScan TSV file and returns a list of lines.
+
+    """
+    all_lines_in_phage = []
+    with open(interpro_path, "r") as interpro_file:
+        lines = interpro_file.readlines()
+        # Initialize lists for hypothetical and annotated proteins
+        # there is no header line in the interpro file
+        for line in lines:
+            parts = line.strip().split("\t")
+            all_lines_in_phage.append(parts)
+    return all_lines_in_phage
+
+
+def remove_ambig_hits(all_lines_in_phage):
+    """
+    Remove ambiguous hits from the InterProScan results. 
+
+    """
+    filtered_interpro_hits = []
+    for line in all_lines_in_phage: 
+        # do not keep lines that do not have a product or e-value
+        if line[8] == "-" or line[5] == '-':
+            continue
+        e_value = float(line[8].lower())
+        if e_value <= MIN_EVALUE: # do not keep hits with e-value greater than global min value
+            filtered_interpro_hits.append(line)
+    return filtered_interpro_hits
+
+
+def select_top_hits(all_lines_in_phage): 
+    """
+    select the top interpro hit by evalue with the most specific description 
+
+    """
+    # remove all ambiguous hits from the unfiltered InterProScan result
+    filtered_interpro_hits = remove_ambig_hits(all_lines_in_phage)
+    # sort by locus in case out of order (use [-1] so it’s robust to extra colons)
+    filtered_interpro_hits.sort(key=lambda r: r[0].split(':')[-1])
+    # create top hits list with only hits of the highest e-value 
+    current_locus = filtered_interpro_hits[0][0].split(':')[1]
+    current_locus_hits = []
+    top_interpro_hits = []
+    for item in filtered_interpro_hits: 
+        locus = item[0].split(':')[1]
+        if locus == current_locus: # if part of the same group, append and continue 
+            current_locus_hits.append(item)
+        else: # if new group, flush the previous group 
+            # filter to find the top interpro hit for (old) current  and append to master list of top hits
+            top_interpro_hits = next_best_hit(current_locus_hits, top_interpro_hits)
+            # reset the current_locus_hits for the next locus
+            current_locus_hits = [item]
+            # change current locus to new locus (DO NOT REUSE until next iteration)"
+            current_locus = locus
+    # flush the final group
+    if current_locus_hits:
+        top_interpro_hits = next_best_hit(current_locus_hits, top_interpro_hits)
+    return top_interpro_hits
+
+
+def next_best_hit(current_locus_hits, top_interpro_hits): 
+    """
+    finds the top interpro hit of the lowest e value but highest specificity
+
+    """
+    best_hit = min(current_locus_hits, key=lambda x: float(x[8].lower()))
+    # best_hit = min(current_locus_hits, key=lambda x: float(x[8].lower().split("e")[0]) * 10 ** float(x[8].lower().split("e")[1]))
+    current_locus_hits.remove(best_hit)  # Remove the best hit from the filtered list
+    if current_locus_hits:
+        next_best_hit = min(current_locus_hits, key=lambda x: float(x[8].lower()))
+        # check if the next best hit contains the same product as the best hit, but is more specific
+        # if so, then change the best hit to the next best hit
+        # example: best hit is "GGDEF", while next best hit is "GGDEF diguanylate cyclase"
+        if best_hit[5] in next_best_hit[5] and len(best_hit[5]) < len(next_best_hit[5]): 
+            if float(next_best_hit[8].lower()) <= NEXT_BEST_EVALUE: 
+                best_hit = next_best_hit
+    top_interpro_hits.append(best_hit)
+    return top_interpro_hits
+
+
+def reference_top_hits(interpro_path):
+    """
+    product and e-value libraries of the original (list based) top hit selection
+
+    """
+    top_hits = select_top_hits(read_interpro_tsv(interpro_path))
+    return {hit[0].split(":")[1]: hit[5] for hit in top_hits}, {hit[0].split(":")[1]: hit[8] for hit in top_hits}
+
+
+def check_engine(engine, tmp_path, seed):
+    """
+    asserts that engine gives the same line count and top hits (in locus order) as the reference
+
+    """
+    interpro_path = tmp_path / "random_aa.fasta.tsv"
+    write_random_tsv(interpro_path, random.Random(seed))
+    with open(interpro_path, "r") as tsv_file:
+        line_count = sum(1 for _ in tsv_file)
+    expected_prod_lib, expected_evalue_lib = reference_top_hits(interpro_path)
+    count, prod_lib, evalue_lib = engine(interpro_path)
+    assert count == line_count
+    assert list(prod_lib.items()) == sorted(expected_prod_lib.items())
+    assert list(evalue_lib.items()) == sorted(expected_evalue_lib.items())
+
+
+@pytest.mark.parametrize("seed", range(TSV_COUNT))
+def test_stream_engine_matches_select_top_hits(tmp_path, seed):
+    check_engine(reduce_interpro_tsv, tmp_path, seed)
+
+
+@pytest.mark.parametrize("seed", range(TSV_COUNT))
+def test_pandas_engine_matches_select_top_hits(tmp_path, seed):
+    pytest.importorskip("pandas")
+    check_engine(select_top_hits_columnar, tmp_path, seed)
@@ -1,14 +1,11 @@
-from Bio import SeqIO # type: ignore
 import argparse
 import os
 import sys
-import itertools
-from Bio.Seq import Seq # type: ignore
 from pathlib import Path
+from export_from_gbk import find_gbk_paths, export_gbk, run_exports
 
 
-
-def convert_gbk(genomes_folder, prefix, output_folder):
+def convert_gbk(genomes_folder, prefix, output_folder, workers=1):
     output_subdir = os.path.join(output_folder, prefix)
     os.makedirs(output_subdir, exist_ok=True)
 
@@ -17,57 +14,19 @@ def convert_gbk(genomes_folder, prefix, output_folder):
     if not gbk_paths:
         print(f"no .gbk files found that start with {prefix} and end with .gbk in {genomes_folder}")
         return
-    # output .faa files to output subdir
-    for gbk in gbk_paths: 
-        print(f"\nProcessing: {gbk}")
-        convert_to_ffn_output(gbk, output_subdir)
-            
-        print("\n" + "*-" * 40)
-
+    # output .ffn files to output subdir (spread over worker processes if workers > 1)
+    run_exports([(gbk, ffn_outputs(gbk, output_subdir)) for gbk in gbk_paths], workers)
 
-def find_gbk_paths(root, prefix):
-    """
-    First try flat search; if none, fall back to recursive.
-    
-    """
-    flat = list(root.glob(f"{prefix}*.gbk"))  # no sorted()
-    if flat:
-        print(f"\n[info] Found {len(flat)} .gbk in {root} (flat search).")
-        print("\n" + "*-" * 40)
-        return flat
 
-    rec = list(root.rglob(f"{prefix}*.gbk"))  # no sorted()
-    if rec:
-        print(f"\n[info] No flat matches; using recursive search. Found {len(rec)} under {root}.")
-    else:
-        print(f"\n[warn] No .gbk files starting with '{prefix}' found in {root} (flat or recursive).")
-    print("\n" + "*-" * 40)
-    return rec
-                
-                
-def convert_to_ffn_output(gbk_pth, output_subdir):
+def ffn_outputs(gbk_pth, output_subdir):
     file = os.path.basename(gbk_pth) 
     ffn_file = os.path.join(output_subdir, file.replace(".gbk", ".fasta"))
-    with open(gbk_pth, "r") as gbk_file: 
-        for record in SeqIO.parse(gbk_file, "genbank"): 
-            for feature in record.features: 
-                if feature.type == "CDS": 
-                    with open(ffn_file, "a") as ffn_out: 
-                        locus_tag = feature.qualifiers.get("locus_tag", ["unknown"])[0]
-                        translation = feature.qualifiers.get("translation",[""])[0]
-                        protein_desc = feature.qualifiers.get("product", ["unknown"])[0]
-                        if protein_desc in ["hypothetical protein", "unknown function"]: 
-                            protein_desc = feature.qualifiers.get("interpro_product", ["hypothetical protein"])[0]
-                        fasta_header = f"{locus_tag} {protein_desc} {record.id}"
-                        cds_seq = feature.location.extract(record.seq)
-                        protein_rec = SeqIO.SeqRecord(
-                            Seq(str(cds_seq)), 
-                            id=f"{locus_tag}",
-                            description = fasta_header
-                        )
-                        SeqIO.write(protein_rec, ffn_out, "fasta")
-                else: 
-                    print(f"No translation for CDS {feature.get("locus_tag", "NULL")}")
+    return {"ffn": ffn_file}
+
+
+def convert_to_ffn_output(gbk_pth, output_subdir):
+    # same writer (and fasta headers) as export_from_gbk.py, with only the .ffn output
+    return export_gbk(gbk_pth, ffn_outputs(gbk_pth, output_subdir))
 
 
 
@@ -77,6 +36,7 @@ if __name__ == "__main__":
     parser.add_argument("--genomes_folder", required= True, help="Path to the input folder containing subdirectories with .gbk files.")
     parser.add_argument("--prefix", required= True, help="Prefix for the output file subdirectory")
     parser.add_argument("--output_folder", required= True, help="Path to the output folder where results will be saved.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of .gbk files to convert at once in separate processes (default: 1).")
     # if all 4 arguments are not provided, print help message
     if len(sys.argv) < 2:
         parser.print_help(sys.stderr)
@@ -84,4 +44,4 @@ if __name__ == "__main__":
         sys.exit(1)
     args = parser.parse_args()
 
-    convert_gbk(args.genomes_folder, args.prefix, args.output_folder)
\ No newline at end of file
+    convert_gbk(args.genomes_folder, args.prefix, args.output_folder, args.workers)
\ No newline at end of file
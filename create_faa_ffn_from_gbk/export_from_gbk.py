@@ -0,0 +1,231 @@
+import argparse
+import os
+import sys
+import time
+import concurrent.futures
+from pathlib import Path
+# the shared GenBank CDS scanner is in the gbk_cds_scanner folder of this repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "gbk_cds_scanner"))
+from gbk_cds_scanner import scan_cds # type: ignore
+
+# file name ending of each output format (replaces .gbk)
+FORMAT_EXTENSIONS = {"faa": ".faa", "ffn": ".ffn", "tsv": "_cds.tsv"}
+FASTA_LINE_WIDTH = 60
+WRITE_BUFFER = 1024 * 1024 # outputs are written in blocks of 1 MB
+CDS_TSV_HEADER = "Locus\tRecord\tStart\tEnd\tStrand\tLength_nt\tLength_aa\tProduct\tInterPro_product\tFunction\n"
+
+
+def export_gbks(genomes_folder, prefix, output_folder, formats, workers=1):
+    """
+    main function: writes the requested output formats for every .gbk file, reading each .gbk once
+
+    """
+    output_subdir = os.path.join(output_folder, prefix)
+    os.makedirs(output_subdir, exist_ok=True)
+
+    root = Path(genomes_folder)
+    gbk_paths = find_gbk_paths(root, prefix)
+    if not gbk_paths:
+        print(f"no .gbk files found that start with {prefix} and end with .gbk in {genomes_folder}")
+        return
+    # output files to output subdir
+    jobs = []
+    for gbk in gbk_paths:
+        outputs = {fmt: os.path.join(output_subdir, os.path.basename(gbk).replace(".gbk", FORMAT_EXTENSIONS[fmt])) for fmt in formats}
+        jobs.append((gbk, outputs))
+    run_exports(jobs, workers)
+
+
+def run_exports(jobs, workers=1):
+    """
+    runs export_gbk for every (gbk path, outputs) job, spread over a pool of worker processes 
+    if workers > 1, prints the result of each file as it finishes and a per file report at the end.
+    a file that fails is reported and does not stop the other files
+
+    """
+    results = []
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(safe_export_gbk, gbk, outputs): gbk for gbk, outputs in jobs}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as error: # the worker process itself died
+                    result = {"gbk": str(futures[future]), "cds": 0, "missing_translation": [], "seconds": 0.0, "error": repr(error)}
+                print_file_result(result)
+                results.append(result)
+    else:
+        for gbk, outputs in jobs:
+            print(f"\nProcessing: {gbk}")
+            result = safe_export_gbk(gbk, outputs)
+            print_file_result(result)
+            results.append(result)
+    print_export_report(results)
+    return results
+
+
+def find_gbk_paths(root, prefix):
+    """
+    First try flat search; if none, fall back to recursive.
+
+    """
+    flat = list(root.glob(f"{prefix}*.gbk"))  # no sorted()
+    if flat:
+        print(f"\n[info] Found {len(flat)} .gbk in {root} (flat search).")
+        print("\n" + "*-" * 40)
+        return flat
+
+    rec = list(root.rglob(f"{prefix}*.gbk"))  # no sorted()
+    if rec:
+        print(f"\n[info] No flat matches; using recursive search. Found {len(rec)} under {root}.")
+    else:
+        print(f"\n[warn] No .gbk files starting with '{prefix}' found in {root} (flat or recursive).")
+    print("\n" + "*-" * 40)
+    return rec
+
+
+def safe_export_gbk(gbk_pth, outputs):
+    """
+    export_gbk, but an error is returned in the result (result["error"]) instead of raised
+
+    """
+    start = time.perf_counter()
+    try:
+        return export_gbk(gbk_pth, outputs)
+    except Exception as error:
+        return {"gbk": str(gbk_pth), "cds": 0, "missing_translation": [], "seconds": time.perf_counter() - start, "error": repr(error)}
+
+
+def export_gbk(gbk_pth, outputs):
+    """
+    reads the CDS features of one .gbk file once and writes every requested output in the same pass.
+    outputs is a library of format -> output path, with the formats:
+        faa  protein sequences (CDS with a translation)
+        ffn  nucleotide sequences of all CDS
+        tsv  CDS feature table (one line per CDS)
+    the .faa and .ffn records of a CDS have the same header. each output is written to a 
+    temporary file that replaces the output only once the whole .gbk is done, so a rerun 
+    overwrites the previous output and an interrupted run never leaves a partial file.
+    returns the number of CDS, the locus tags of the CDS without a translation and the time taken
+
+    """
+    start = time.perf_counter()
+    cds_count, missing_translation = 0, []
+    qualifiers = ["locus_tag", "product", "interpro_product", "translation"]
+    if "tsv" in outputs:
+        qualifiers.append("function")
+    temp_paths = {fmt: f"{path}.tmp" for fmt, path in outputs.items()}
+    handles = {}
+    try:
+        for fmt, temp_path in temp_paths.items():
+            handles[fmt] = open(temp_path, "w", buffering=WRITE_BUFFER)
+        if "tsv" in handles:
+            handles["tsv"].write(CDS_TSV_HEADER)
+        # the nucleotide sequence is only read from the gbk if the .ffn is written
+        for cds in scan_cds(gbk_pth, qualifiers, sequence="ffn" in outputs):
+            cds_count += 1
+            fasta_header = cds_fasta_header(cds)
+            if "translation" not in cds["qualifiers"]:
+                missing_translation.append(cds["qualifiers"].get("locus_tag", ["NULL"])[0])
+            elif "faa" in handles:
+                handles["faa"].write(format_fasta(fasta_header, cds["qualifiers"]["translation"][0]))
+            if "ffn" in handles:
+                handles["ffn"].write(format_fasta(fasta_header, cds["sequence"]))
+            if "tsv" in handles:
+                handles["tsv"].write(cds_tsv_line(cds))
+        for handle in handles.values():
+            handle.close()
+        for fmt, temp_path in temp_paths.items():
+            os.replace(temp_path, outputs[fmt])
+    finally:
+        for fmt, handle in handles.items():
+            handle.close()
+            if os.path.exists(temp_paths[fmt]): # only left if the export failed
+                os.remove(temp_paths[fmt])
+    return {"gbk": str(gbk_pth), "cds": cds_count, "missing_translation": missing_translation, "seconds": time.perf_counter() - start, "error": None}
+
+
+def print_file_result(result):
+    """
+    prints the CDS without a translation (or the error) of one exported .gbk file
+
+    """
+    if result["error"]:
+        print(f"\nError while processing {result['gbk']}: {result['error']}")
+    for locus_tag in result["missing_translation"]:
+        print(f"No translation for CDS {locus_tag}")
+    print(f"{os.path.basename(result['gbk'])}: {result['cds']} CDS in {result['seconds']:.2f}s")
+    print("\n" + "*-" * 40)
+
+
+def print_export_report(results):
+    """
+    prints one line per .gbk file (sorted by name) with the number of CDS, CDS without a 
+    translation and time taken, and the totals
+
+    """
+    print("\nPer file report:\n")
+    print("File\tCDS\tMissing translations\tTime (s)\tStatus")
+    for result in sorted(results, key=lambda r: os.path.basename(r["gbk"])):
+        status = "failed" if result["error"] else "done"
+        print(f"{os.path.basename(result['gbk'])}\t{result['cds']}\t{len(result['missing_translation'])}\t{result['seconds']:.2f}\t{status}")
+    failed = sum(1 for result in results if result["error"])
+    print(f"\n{len(results)} file(s): {sum(result['cds'] for result in results)} CDS, "
+          f"{sum(len(result['missing_translation']) for result in results)} missing translations, {failed} failed")
+
+
+def format_fasta(header, sequence):
+    """
+    returns one fasta record as text, with the sequence wrapped at FASTA_LINE_WIDTH 
+    (same layout as SeqIO.write(..., "fasta"))
+
+    """
+    lines = [f">{header}\n"]
+    lines.extend(sequence[i:i + FASTA_LINE_WIDTH] + "\n" for i in range(0, len(sequence), FASTA_LINE_WIDTH))
+    return "".join(lines)
+
+
+def cds_fasta_header(cds):
+    """
+    returns the fasta header of a CDS: locus tag, product (the InterProScan product if
+    the product is hypothetical) and record id
+
+    """
+    locus_tag = cds["qualifiers"].get("locus_tag", ["unknown"])[0]
+    protein_desc = cds["qualifiers"].get("product", ["unknown"])[0]
+    if protein_desc in ["hypothetical protein", "unknown function"]:
+        protein_desc = cds["qualifiers"].get("interpro_product", ["hypothetical protein"])[0]
+    return f"{locus_tag} {protein_desc} {cds['record_id']}"
+
+
+def cds_tsv_line(cds):
+    """
+    returns the CDS feature table line of a CDS (1-based coordinates)
+
+    """
+    qualifiers = cds["qualifiers"]
+    strand = {1: "+", -1: "-"}.get(cds["strand"], ".")
+    fields = [
+        qualifiers.get("locus_tag", ["unknown"])[0], cds["record_id"], str(cds["start"] + 1), str(cds["end"]), strand,
+        str(sum(end - start for start, end, _ in cds["parts"])), str(len(qualifiers.get("translation", [""])[0])),
+        qualifiers.get("product", [""])[0], qualifiers.get("interpro_product", [""])[0], qualifiers.get("function", [""])[0],
+    ]
+    return "\t".join(fields) + "\n"
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create .faa, .ffn and/or CDS table .tsv files for all .gbk files found in passed directory, reading each .gbk once.")
+
+    parser.add_argument("--genomes_folder", required= True, help="Path to the input folder containing subdirectories with .gbk files.")
+    parser.add_argument("--prefix", required= True, help="Prefix for the output file subdirectory")
+    parser.add_argument("--output_folder", required= True, help="Path to the output folder where results will be saved.")
+    parser.add_argument("--formats", nargs="+", choices=list(FORMAT_EXTENSIONS), default=["faa", "ffn"], help="Output formats to write (default: faa ffn).")
+    parser.add_argument("--workers", type=int, default=1, help="Number of .gbk files to convert at once in separate processes (default: 1).")
+    if len(sys.argv) < 2:
+        parser.print_help(sys.stderr)
+        print("\n")
+        sys.exit(1)
+    args = parser.parse_args()
+
+    export_gbks(args.genomes_folder, args.prefix, args.output_folder, args.formats, args.workers)
@@ -0,0 +1,148 @@
+import argparse
+import heapq
+import os
+import sys
+import time
+
+"""
+Merge the <target>_<genome>.tsv DIAMOND results of find_top_depol_hits.py (or filter_depol_hits.py)
+into one ranked table, with the top hits of each target file and genome
+
+"""
+
+# columns of the result files, same order as OUTFMT_FIELDS in find_top_depol_hits.py
+OUTFMT_FIELDS = ["qseqid", "sseqid", "pident", "length", "mismatch", "gapopen", "qstart", "qend", "sstart", "send", "evalue", "bitscore", "qlen", "slen"]
+FIELD = {field: i for i, field in enumerate(OUTFMT_FIELDS)}
+TABLE_HEADER = "Target\tGenome\tRank\tQuery\tSubject\tProduct\tIdentity\tAlignment_length\tE-value\tBitscore\tQuery_cover\tSubject_cover\tQlen\tSlen\n"
+
+
+def aggregate_hits(results_folder, genomes_path, output_table, top_n=5):
+    """
+    main function: streams every result file in results_folder, keeps the best hit of each subject
+    and the top_n subjects (by bitscore, then e-value) of each target file and genome, looks up the
+    product of the kept subjects in the genome's fasta headers and writes one table, ranked per target by bitscore
+
+    """
+    start = time.perf_counter()
+    genomes = find_genomes(genomes_path)
+    top_hits, skipped, hit_count = {}, [], 0
+    for name in sorted(os.listdir(results_folder)):
+        if not name.endswith(".tsv"):
+            continue
+        target, genome = split_result_name(name, genomes)
+        if genome is None:
+            skipped.append(name)
+            continue
+        hits, file_hits = top_file_hits(os.path.join(results_folder, name), top_n)
+        top_hits[target, genome] = hits
+        hit_count += file_hits
+    for name in skipped:
+        print(f"[skip] {name}: no proteome in {genomes_path} matches the end of the file name")
+
+    # products are only looked up for the subjects that were kept
+    subjects = {}
+    for (_, genome), hits in top_hits.items():
+        subjects.setdefault(genome, set()).update(fields[FIELD["sseqid"]] for fields in hits)
+    products = {genome: read_products(genomes[genome], ids) for genome, ids in subjects.items()}
+
+    rows = []
+    for (target, genome), hits in top_hits.items():
+        for rank, fields in enumerate(hits, 1):
+            rows.append((target, -float(fields[FIELD["bitscore"]]), float(fields[FIELD["evalue"]]), genome, rank, fields))
+    rows.sort(key=lambda row: row[:5])
+    with open(output_table, "w") as out_file:
+        out_file.write(TABLE_HEADER)
+        for target, _, _, genome, rank, fields in rows:
+            out_file.write(table_line(target, genome, rank, fields, products[genome].get(fields[FIELD["sseqid"]], "")))
+    print(f"{len(rows)} top hits of {hit_count} hits in {len(top_hits)} result files written to {output_table} in {time.perf_counter() - start:.2f}s")
+
+
+def find_genomes(genomes_path):
+    """
+    library of proteome file name -> path of the .faa/.fasta files in genomes_path
+
+    """
+    return {name: os.path.join(genomes_path, name) for name in os.listdir(genomes_path) if name.endswith(".fasta") or name.endswith(".faa")}
+
+
+def split_result_name(name, genomes):
+    """
+    splits a <target>_<genome>.tsv file name into the target name and genome (proteome file name),
+    using the longest proteome name the file name ends with. returns (None, None) if none match
+
+    """
+    stem = name[:-len(".tsv")]
+    matches = [genome for genome in genomes if stem.endswith("_" + genome)]
+    if not matches:
+        return None, None
+    genome = max(matches, key=len)
+    return stem[:-len(genome) - 1], genome
+
+
+def top_file_hits(result_path, top_n):
+    """
+    streams one result file and returns the best hit (lists of fields) of its top_n subjects, best
+    first, and the number of hits read. only the best hit (HSP) of each subject is held, so a subject
+    with several HSPs takes one place (earlier lines win ties), top_n 0 keeps all subjects
+
+    """
+    best_hits, hit_count = {}, 0
+    with open(result_path, "r") as result_file:
+        for line in result_file:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < len(OUTFMT_FIELDS):
+                continue
+            hit_count += 1
+            entry = (float(fields[FIELD["bitscore"]]), -float(fields[FIELD["evalue"]]), -hit_count, fields)
+            best = best_hits.get(fields[FIELD["sseqid"]])
+            if best is None or entry[:3] > best[:3]:
+                best_hits[fields[FIELD["sseqid"]]] = entry
+    top = heapq.nlargest(top_n or len(best_hits), best_hits.values(), key=lambda entry: entry[:3])
+    return [entry[3] for entry in top], hit_count
+
+
+def read_products(fasta_path, ids):
+    """
+    library of protein id -> description (fasta header after the id) for the given ids,
+    reading only the header lines of the fasta file
+
+    """
+    products = {}
+    with open(fasta_path, "r") as fasta_file:
+        for line in fasta_file:
+            if line.startswith(">"):
+                parts = line[1:].strip().split(None, 1)
+                if parts and parts[0] in ids:
+                    products[parts[0]] = parts[1] if len(parts) > 1 else ""
+    return products
+
+
+def table_line(target, genome, rank, fields, product):
+    """
+    one line of the ranked table, with the query and subject coverage (percentage of the qlen/slen
+    covered by the alignment)
+
+    """
+    query_cover = (abs(int(fields[FIELD["qend"]]) - int(fields[FIELD["qstart"]])) + 1) * 100 / int(fields[FIELD["qlen"]])
+    subject_cover = (abs(int(fields[FIELD["send"]]) - int(fields[FIELD["sstart"]])) + 1) * 100 / int(fields[FIELD["slen"]])
+    values = [
+        target, genome, str(rank), fields[FIELD["qseqid"]], fields[FIELD["sseqid"]], product, fields[FIELD["pident"]], fields[FIELD["length"]],
+        fields[FIELD["evalue"]], fields[FIELD["bitscore"]], f"{query_cover:.1f}", f"{subject_cover:.1f}", fields[FIELD["qlen"]], fields[FIELD["slen"]],
+    ]
+    return "\t".join(values) + "\n"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the <target>_<genome>.tsv DIAMOND results of find_top_depol_hits.py into one ranked table of the top hits of each target file and genome.")
+
+    parser.add_argument("--results_folder", required= True, help="Path to the folder with the <target>_<genome>.tsv result files (<output_folder>/<prefix> of find_top_depol_hits.py).")
+    parser.add_argument("--genomes_path", required= True, help="Path to the genome proteomes (.faa/.fasta) that were searched, used for the genome names and the subject products.")
+    parser.add_argument("--output_table", required= True, help="Path of the ranked table (.tsv) to write.")
+    parser.add_argument("--top_n", type=int, default=5, help="Number of top subjects (best hit of each) kept per target file and genome, 0 keeps all (default: 5).")
+    if len(sys.argv) < 2:
+        parser.print_help(sys.stderr)
+        print("\n")
+        sys.exit(1)
+    args = parser.parse_args()
+
+    aggregate_hits(args.results_folder, args.genomes_path, args.output_table, args.top_n)
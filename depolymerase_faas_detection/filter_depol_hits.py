@@ -0,0 +1,225 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np # type: ignore
+
+"""
+Filter the raw DIAMOND hits cached by find_top_depol_hits.py --raw with coverage, identity,
+e-value and top N thresholds, without running DIAMOND again
+
+"""
+
+ID_FIELDS = ["qseqid", "sseqid"]
+FLOAT_FIELDS = ["pident", "evalue", "bitscore"] # every other outfmt field is an integer
+
+
+def filter_cached_hits(hits_cache, output_folder, min_query_cover=0, min_subject_cover=0, min_identity=0, max_evalue=0.001, top_n=5):
+    """
+    main function: writes the cached hits that pass the thresholds to one <target>_<genome>.tsv
+    per target file and genome in output_folder (same files as find_top_depol_hits.py, no file 
+    if no hit passes). the files of earlier runs for the cached target files and genomes are 
+    removed first, so a stricter rerun into the same folder never leaves looser results behind.
+    returns the paths of the written files
+
+    """
+    start = time.perf_counter()
+    hits = load_hits(hits_cache)
+    if max_evalue > hits["search_evalue"]:
+        print(f"[warn] the hits were searched with --evalue {hits['search_evalue']:g}, hits with e-values between that and {max_evalue:g} are not in the cache")
+    rows = filter_hits(hits, min_query_cover, min_subject_cover, min_identity, max_evalue, top_n)
+    os.makedirs(output_folder, exist_ok=True)
+    removed = remove_result_files(hits, output_folder)
+    written = write_hits(hits, rows, output_folder)
+    print(f"{len(rows)} of {len(hits['target'])} cached hits passed (query cover >= {min_query_cover}, subject cover >= {min_subject_cover}, "
+          f"identity >= {min_identity}, e-value <= {max_evalue:g}, top {top_n or 'all'} subjects per query)")
+    stale = len(set(removed) - set(written))
+    print(f"{len(written)} result files written to {output_folder} in {time.perf_counter() - start:.2f}s" + (f", {stale} result files of an earlier run without hits now removed" if stale else ""))
+    return written
+
+
+def pack_hits(raw_files, hits_cache, fields, search_evalue):
+    """
+    reads raw DIAMOND outfmt 6 files (list of (target name, genome name, path)) into one compressed
+    columnar cache: one array per field, the ids stored once with a code per hit, and the number
+    format of every float field kept so the hits are written back exactly as DIAMOND wrote them.
+    the rows keep the order of the files and of the hits in them. returns the number of hits
+
+    """
+    columns = {field: [] for field in fields}
+    formats = {field: [] for field in FLOAT_FIELDS}
+    names = {field: {} for field in ID_FIELDS}
+    targets, genomes, target_codes, genome_codes = {}, {}, [], []
+    for target, genome, path in raw_files:
+        target_code = targets.setdefault(target, len(targets))
+        genome_code = genomes.setdefault(genome, len(genomes))
+        with open(path, "r") as hits_file:
+            for line in hits_file:
+                values = line.rstrip("\n").split("\t")
+                for field, value in zip(fields, values):
+                    if field in names:
+                        columns[field].append(names[field].setdefault(value, len(names[field])))
+                    elif field in formats:
+                        columns[field].append(float(value))
+                        formats[field].append(number_format(value))
+                    else:
+                        columns[field].append(int(value))
+                target_codes.append(target_code)
+                genome_codes.append(genome_code)
+    arrays = {
+        "fields": np.array(fields), "targets": np.array(list(targets), dtype=str), "genomes": np.array(list(genomes), dtype=str),
+        "target": np.array(target_codes, dtype=np.int32), "genome": np.array(genome_codes, dtype=np.int32),
+        "search_evalue": np.float64(search_evalue),
+    }
+    for field in fields:
+        if field in names:
+            arrays[field] = np.array(columns[field], dtype=np.int32)
+            arrays[f"{field}_names"] = np.array(list(names[field]), dtype=str)
+        elif field in formats:
+            arrays[field] = np.array(columns[field], dtype=np.float64)
+            arrays[f"{field}_format"] = np.array(formats[field], dtype=np.int8)
+        else:
+            arrays[field] = np.array(columns[field], dtype=np.int64)
+    # write to a temp file, then rename so the cache is never left half written
+    with open(hits_cache + ".tmp", "wb") as cache_file:
+        np.savez_compressed(cache_file, **arrays)
+    os.replace(hits_cache + ".tmp", hits_cache)
+    return len(target_codes)
+
+
+def load_hits(hits_cache):
+    """
+    loads the hits cache into a library of column name -> array
+
+    """
+    with np.load(hits_cache) as cache:
+        hits = {name: cache[name] for name in cache.files}
+    hits["fields"] = hits["fields"].tolist()
+    hits["search_evalue"] = float(hits["search_evalue"])
+    return hits
+
+
+def filter_hits(hits, min_query_cover=0, min_subject_cover=0, min_identity=0, max_evalue=0.001, top_n=5):
+    """
+    returns the rows (in cache order) of the hits that pass the thresholds. coverage is the
+    percentage of the query/subject length covered by the alignment, like DIAMOND's --query-cover
+    and --subject-cover. top_n keeps, per target file, genome and query, the hits of the first
+    top_n subjects that pass (DIAMOND lists the hits of a query best first), 0 keeps all
+
+    """
+    keep = hits["evalue"] <= max_evalue
+    if min_identity:
+        keep &= hits["pident"] >= min_identity
+    if min_query_cover:
+        keep &= (np.abs(hits["qend"] - hits["qstart"]) + 1) * 100 / hits["qlen"] >= min_query_cover
+    if min_subject_cover:
+        keep &= (np.abs(hits["send"] - hits["sstart"]) + 1) * 100 / hits["slen"] >= min_subject_cover
+    rows = np.flatnonzero(keep)
+    if not top_n or not len(rows):
+        return rows
+    query = (hits["target"][rows].astype(np.int64) * len(hits["genomes"]) + hits["genome"][rows]) * len(hits["qseqid_names"]) + hits["qseqid"][rows]
+    # every query/subject pair, with the position of its first hit
+    _, first, pair = np.unique(query * len(hits["sseqid_names"]) + hits["sseqid"][rows], return_index=True, return_inverse=True)
+    # rank of each subject within its query, by the position of its first hit
+    order = np.lexsort((first, query[first]))
+    sorted_query = query[first][order]
+    group_start = np.flatnonzero(np.r_[True, sorted_query[1:] != sorted_query[:-1]])
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order)) - np.repeat(group_start, np.diff(np.r_[group_start, len(order)]))
+    return rows[rank[pair.ravel()] < top_n]
+
+
+def result_file(hits, target_code, genome_code, output_folder):
+    """
+    path of the <target>_<genome>.tsv result file of a target file and genome (codes in the cache)
+
+    """
+    return os.path.join(output_folder, f"{hits['targets'][target_code]}_{hits['genomes'][genome_code]}.tsv")
+
+
+def remove_result_files(hits, output_folder):
+    """
+    removes the result files in output_folder of every target file and genome pair with hits in 
+    the cache. returns the paths of the removed files
+
+    """
+    pairs = np.unique(hits["target"].astype(np.int64) * len(hits["genomes"]) + hits["genome"])
+    removed = []
+    for pair in pairs.tolist():
+        output_file = result_file(hits, pair // len(hits["genomes"]), pair % len(hits["genomes"]), output_folder)
+        if os.path.exists(output_file):
+            os.remove(output_file)
+            removed.append(output_file)
+    return removed
+
+
+def write_hits(hits, rows, output_folder):
+    """
+    writes the given rows to one <target>_<genome>.tsv per target file and genome (rows of a
+    pair are next to each other in the cache). returns the paths of the written files
+
+    """
+    written = []
+    pair = hits["target"][rows].astype(np.int64) * len(hits["genomes"]) + hits["genome"][rows]
+    starts = np.flatnonzero(np.r_[True, pair[1:] != pair[:-1]]) if len(rows) else []
+    for begin, end in zip(starts, list(starts[1:]) + [len(rows)]):
+        pair_rows = rows[begin:end]
+        output_file = result_file(hits, hits["target"][pair_rows[0]], hits["genome"][pair_rows[0]], output_folder)
+        with open(output_file, "w") as out_file:
+            out_file.writelines(format_rows(hits, pair_rows))
+        written.append(output_file)
+    return written
+
+
+def format_rows(hits, rows):
+    """
+    returns the given rows as outfmt 6 lines, column by column
+
+    """
+    columns = []
+    for field in hits["fields"]:
+        if field in ID_FIELDS:
+            columns.append(hits[f"{field}_names"][hits[field][rows]].tolist())
+        elif field in FLOAT_FIELDS:
+            columns.append([format_number(value, fmt) for value, fmt in zip(hits[field][rows].tolist(), hits[f"{field}_format"][rows].tolist())])
+        else:
+            columns.append([str(value) for value in hits[field][rows].tolist()])
+    return ["\t".join(values) + "\n" for values in zip(*columns)]
+
+
+def number_format(text):
+    """
+    format code of a number as DIAMOND wrote it: the number of decimals, negative (-decimals - 1)
+    for scientific notation (e.g. "65.1" -> 1, "1.53e-13" -> -3)
+
+    """
+    mantissa = text.lower().split("e")[0]
+    decimals = len(mantissa.split(".")[1]) if "." in mantissa else 0
+    return -decimals - 1 if "e" in text.lower() else decimals
+
+
+def format_number(value, fmt):
+    """
+    writes a number back with its format code from number_format
+
+    """
+    return f"{value:.{-fmt - 1}e}" if fmt < 0 else f"{value:.{fmt}f}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Filter the raw DIAMOND hits cached by find_top_depol_hits.py --raw, without running DIAMOND again.")
+
+    parser.add_argument("--hits_cache", required= True, help="Path to the <prefix>_raw_hits.npz hits cache written by find_top_depol_hits.py --raw.")
+    parser.add_argument("--output_folder", required= True, help="Path to the output folder where the filtered <target>_<genome>.tsv files will be saved.")
+    parser.add_argument("--min_query_cover", type=float, default=0, help="Minimum percentage of the query covered by the alignment (default: 0).")
+    parser.add_argument("--min_subject_cover", type=float, default=0, help="Minimum percentage of the subject covered by the alignment (default: 0).")
+    parser.add_argument("--min_identity", type=float, default=0, help="Minimum percent identity (default: 0).")
+    parser.add_argument("--max_evalue", type=float, default=0.001, help="Maximum e-value (default: 0.001).")
+    parser.add_argument("--top_n", type=int, default=5, help="Number of top subjects kept per query and genome, 0 keeps all (default: 5).")
+    if len(sys.argv) < 2:
+        parser.print_help(sys.stderr)
+        print("\n")
+        sys.exit(1)
+    args = parser.parse_args()
+
+    filter_cached_hits(args.hits_cache, args.output_folder, args.min_query_cover, args.min_subject_cover, args.min_identity, args.max_evalue, args.top_n)
@@ -6,6 +6,13 @@ from pathlib import Path
 from collections import defaultdict
 import re
 import subprocess
+import threading
+import time
+import hashlib
+import json
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from filter_depol_hits import pack_hits, filter_cached_hits
 import pandas as pd # type: ignore
 
 """
@@ -14,79 +21,487 @@ Use DIAMOND to find top hit proteins for each target gene from reference fasta f
 """
 
 QUERY_COVER_THRESH = 0
+MAX_TARGET_SEQS = 5
+EVALUE = 0.001 # DIAMOND default e-value cutoff
+RAW_EVALUE = 1.0 # e-value cutoff of the permissive --raw searches
+# DIAMOND settings of the normal searches and of the permissive --raw searches (all hits are kept)
+SEARCH = {"cover": QUERY_COVER_THRESH, "max_target_seqs": MAX_TARGET_SEQS, "evalue": EVALUE}
+RAW_SEARCH = {"cover": 0, "max_target_seqs": 0, "evalue": RAW_EVALUE}
+DB_CACHE_NAME = "database_cache.json"
+DB_CACHE_LOCK = threading.Lock()
+OUTFMT_FIELDS = ["qseqid", "sseqid", "pident", "length", "mismatch", "gapopen", "qstart", "qend", "sstart", "send", "evalue", "bitscore", "qlen", "slen"]
 
-def get_top_hits(target_genes, genomes_path, output_folder, prefix):
+def get_top_hits(target_genes, genomes_path, output_folder, prefix, combined=False, threads=None, jobs=1, raw=False):
     os.makedirs(output_folder, exist_ok=True)
     databases_dir = os.path.join(output_folder, "databases")
     os.makedirs(databases_dir, exist_ok=True)
     output_results_folder = os.path.join(output_folder, prefix)
     os.makedirs(output_results_folder, exist_ok=True)
+    # DIAMOND's console output of every job is written to its own log file
+    log_dir = os.path.join(output_folder, f"{prefix}_diamond_logs")
+    os.makedirs(log_dir, exist_ok=True)
 
     print("\n" + "#@*"* 35 + '\n')
-    
-    if os.path.isdir(genomes_path):
-        # Iterate through genomes and create database to blastp against 
-        for db in os.listdir(genomes_path): 
-            db_path = os.path.join(genomes_path, db)
-            if not db.endswith(".fasta") and not db.endswith(".faa"): 
-                print(f"[skip] {db}")
-                print("\n" + "#@*"* 35 + '\n')
-                continue
-            print(f"Processing db: {db}")
+    # databases are only rebuilt if their proteome or the DIAMOND version changed
+    db_cache_path = os.path.join(databases_dir, DB_CACHE_NAME)
+    db_cache = load_db_cache(db_cache_path)
+    db_cache["diamond_version"] = diamond_version()
+
+    if not os.path.isdir(genomes_path):
+        print(f"{genomes_path} is not a folder")
+        return
+    genomes, target_groups = find_inputs(genomes_path, target_genes)
+    if not genomes or not target_groups:
+        print("No proteomes or target gene files found.")
+        return
+    threads = threads or os.cpu_count() or 1
+    # with --raw the searches keep all hits in a temporary folder, that is packed into the hits cache
+    search = RAW_SEARCH if raw else SEARCH
+    search_folder = os.path.join(output_folder, f"{prefix}_raw") if raw else output_results_folder
+    os.makedirs(search_folder, exist_ok=True)
+    batch_start = time.time()
+    if combined:
+        # one database of all proteomes, searched once with all target genes
+        results = combined_top_hits(genomes, target_groups, databases_dir, search_folder, os.path.join(output_folder, f"{prefix}_combined_hits.tsv"), db_cache, db_cache_path, log_dir, threads, search)
+    else:
+        # a database per genome, searched with every target gene file
+        results = schedule_searches(genomes, target_groups, databases_dir, search_folder, db_cache, db_cache_path, log_dir, threads, jobs, search)
+    write_job_summary(results, os.path.join(output_folder, f"{prefix}_diamond_jobs.log"), time.time() - batch_start, threads)
+    if raw:
+        cache_raw_hits(results, search_folder, os.path.join(output_folder, f"{prefix}_raw_hits.npz"), output_results_folder, genomes, target_groups)
+
+
+def cache_raw_hits(results, raw_folder, hits_cache, output_results_folder, genomes, target_groups):
+    """
+    packs the raw hits of the --raw searches into the hits cache (and removes the raw files), 
+    then writes the hits that pass the normal thresholds to the usual result files. the result 
+    files of an earlier run are removed first for every searched target file and genome (also the 
+    ones without any raw hit, that are not in the cache). other thresholds can then be applied 
+    to the cache with filter_depol_hits.py
+
+    """
+    for target_gene_group, _ in target_groups:
+        for db, _ in genomes:
+            output_file = os.path.join(output_results_folder, f"{target_group_name(target_gene_group)}_{db}.tsv")
+            if os.path.exists(output_file):
+                os.remove(output_file)
+    raw_files = sorted(output for result in results if result["kind"] == "blastp" for output in result["outputs"])
+    hit_count = pack_hits(raw_files, hits_cache, OUTFMT_FIELDS, RAW_SEARCH["evalue"])
+    for _, _, path in raw_files:
+        os.remove(path)
+    if not os.listdir(raw_folder):
+        os.rmdir(raw_folder)
+    print(f"{hit_count} raw hits from {len(raw_files)} searches cached in {hits_cache}\n")
+    filter_cached_hits(hits_cache, output_results_folder, QUERY_COVER_THRESH, QUERY_COVER_THRESH, 0, EVALUE, MAX_TARGET_SEQS)
+
+
+def find_inputs(genomes_path, target_genes):
+    """
+    returns the (name, path) of the proteomes (.fasta/.faa) and of the target gene files (.fasta), 
+    sorted by name
+
+    """
+    genomes = []
+    for db in sorted(os.listdir(genomes_path)):
+        if not db.endswith(".fasta") and not db.endswith(".faa"): 
+            print(f"[skip] {db}")
+            continue
+        genomes.append((db, os.path.join(genomes_path, db)))
+    target_groups = []
+    for target_gene_group in sorted(os.listdir(target_genes)):
+        if not target_gene_group.endswith(".fasta"): 
+            print(f"[skip] {os.path.join(target_genes, target_gene_group)} is not a .fasta file")
+            continue
+        target_groups.append((target_gene_group, os.path.join(target_genes, target_gene_group)))
+    return genomes, target_groups
+
+
+def schedule_searches(genomes, target_groups, databases_dir, output_results_folder, db_cache, db_cache_path, log_dir, threads, jobs=1, search=SEARCH):
+    """
+    Run the makedb job of every genome and a blastp job of every target gene file against it, 
+    up to `jobs` at a time, each running job getting an equal --threads share of the budget. 
+    the searches of a genome are only queued once its database is built (or found up to date 
+    in the cache), and are skipped if it could not be built. 
+    progress and per-job wall time are reported as jobs finish
 
+    """
+    total = len(genomes) * (len(target_groups) + 1)
+    jobs = max(1, min(jobs, total, threads))
+    threads_per_job = max(1, threads // jobs)
+    print(f"\nRunning {total} DIAMOND job(s) ({len(genomes)} makedb, {total - len(genomes)} blastp), {jobs} at a time with {threads_per_job} thread(s) each ({threads} threads total).\n")
+
+    results = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = {}
+        for db, db_path in genomes:
             database_path = f"{databases_dir}/{db}_database.dmnd"
-            command = ["diamond", "makedb", "--in", db_path, "-d", database_path]
-            print(">>", " ".join(command), "\n")
-            try:
-                result = subprocess.run(command, check=True)
-                print(f"{db} database created successfully!\n")
-            except subprocess.CalledProcessError as e:
-                print("There was an error creating database.\n")
-                print(e)
-                print("\n" + "#@*"* 35 + '\n')
+            pending[executor.submit(build_database, db_path, database_path, db_cache, db_cache_path, threads_per_job, log_dir, db)] = (db, database_path)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                db, database_path = pending.pop(future)
+                result = future.result()
+                results.append(result)
+                if result["kind"] != "blastp":
+                    if result["returncode"] == 0:
+                        # the database exists, so the searches against it can start
+                        for target_gene_group, target_path in target_groups:
+                            future = executor.submit(run_search, target_gene_group, target_path, database_path, db, output_results_folder, threads_per_job, log_dir, search)
+                            pending[future] = (db, database_path)
+                    else:
+                        total -= len(target_groups)
+                        result["messages"].append(f"Skipping the {len(target_groups)} search(es) against {db}, its database could not be built")
+                running = min(jobs, len(pending))
+                print_job_result(result, f"[{len(results)}/{total} done | {running} running | {len(pending) - running} queued] ")
+    print("\n" + "#@*"* 35 + '\n')
+    return results
+
+
+def run_search(target_gene_group, target_path, database_path, db, output_results_folder, threads, log_dir, search=SEARCH):
+    """
+    blastp one target gene file against the database of one genome with the search settings 
+    (SEARCH or RAW_SEARCH). the result file is removed if there are no hits, the result 
+    lists the kept file in result["outputs"] as (target name, genome, path)
+
+    """
+    output_file = f"{output_results_folder}/{target_group_name(target_gene_group)}_{db}.tsv"
+    command = ["diamond", "blastp", "-d", database_path, "-q", target_path, "-o", output_file, "--query-cover", str(search["cover"]), "--subject-cover", str(search["cover"]), "--max-target-seqs", str(search["max_target_seqs"]), "--evalue", f"{search['evalue']:g}", "--outfmt", "6"] + OUTFMT_FIELDS
+    result = run_diamond_job(f"{target_group_name(target_gene_group)}_{db}", "blastp", db, command, threads, log_dir)
+    result["outputs"] = []
+    if result["returncode"] != 0:
+        result["messages"].append(f"There was an error blastping {target_gene_group} against {database_path}, see {result['log']}")
+    elif os.path.exists(output_file) and os.path.getsize(output_file) == 0:
+        os.remove(output_file)
+    elif os.path.exists(output_file):
+        result["outputs"].append((target_group_name(target_gene_group), db, output_file))
+        result["messages"].append(f"Results saved to {output_file}")
+    return result
+
+
+def run_diamond_job(name, kind, genome, command, threads, log_dir):
+    """
+    Run a single diamond command with --threads threads, the command and DIAMOND's console 
+    output are written to <name>.log in log_dir. returns the job result with its exit code and 
+    wall time. jobs run in worker threads, so their messages are returned in the result 
+    (result["messages"]) and printed by the scheduler as one block
+
+    """
+    command = command + ["--threads", str(threads)]
+    log_path = os.path.join(log_dir, f"{name}.log")
+    messages = []
+    started = timestamp()
+    start = time.time()
+    try:
+        with open(log_path, "w") as log_file:
+            log_file.write(">> " + " ".join(command) + "\n\n")
+            log_file.flush()
+            returncode = subprocess.run(command, stdout=log_file, stderr=subprocess.STDOUT).returncode
+    except OSError as e:
+        messages.append(f"There was an error running {name}: {e}")
+        returncode = -1
+    return {"name": name, "kind": kind, "genome": genome, "command": command, "threads": threads, "returncode": returncode,
+            "started": started, "elapsed": time.time() - start, "log": log_path, "messages": messages}
+
+
+def combined_top_hits(genomes, target_groups, databases_dir, output_results_folder, combined_hits, db_cache, db_cache_path, log_dir, threads, search=SEARCH):
+    """
+    Builds ONE DIAMOND database of all proteomes (protein ids tagged with their genome) and runs 
+    ONE diamond blastp with all target gene files (query ids tagged with their target file), then 
+    splits the hits back into the usual <target>_<genome>.tsv files with the original ids. 
+    every hit of every genome is kept in the search (--max-target-seqs 0), and the top 
+    max_target_seqs subjects of each query (of the search settings) are then kept per genome, as in 
+    the per genome search. e-values grow with the database size, so the search uses a relaxed e-value 
+    cutoff and each hit's e-value is scaled back to the size of its own genome before the search 
+    settings' e-value is applied. 
+    the raw (tagged) hits are kept in combined_hits. both jobs use all threads, 
+    returns their job results
+
+    """
+    print(f"Combining {len(genomes)} proteomes and {len(target_groups)} target gene files\n")
+
+    combined_proteomes = os.path.join(databases_dir, "combined_proteomes.faa")
+    combined_targets = os.path.join(databases_dir, "combined_targets.fasta")
+    genome_letters = write_tagged_fasta([path for _, path in genomes], combined_proteomes)
+    write_tagged_fasta([path for _, path in target_groups], combined_targets)
+    # the loosest cutoff any genome needs, once its e-values are scaled back to its own size
+    search_evalue = search["evalue"] * sum(genome_letters) / max(min(genome_letters), 1)
+
+    database_path = os.path.join(databases_dir, "combined_database.dmnd")
+    results = [build_database(combined_proteomes, database_path, db_cache, db_cache_path, threads, log_dir, "combined")]
+    print_job_result(results[0])
+    if results[0]["returncode"] != 0:
+        return results
+
+    command = ["diamond", "blastp", "-d", database_path, "-q", combined_targets, "-o", combined_hits, "--query-cover", str(search["cover"]), "--subject-cover", str(search["cover"]), "--max-target-seqs", "0", "--evalue", f"{search_evalue:g}", "--outfmt", "6"] + OUTFMT_FIELDS
+    results.append(run_diamond_job("combined_blastp", "blastp", "combined", command, threads, log_dir))
+    print_job_result(results[-1])
+    if results[-1]["returncode"] != 0:
+        print(f"There was an error blastping the combined target genes, see {results[-1]['log']}\n")
+        return results
+    written = split_combined_hits(combined_hits, target_groups, genomes, genome_letters, output_results_folder, search)
+    results[-1]["outputs"] = written
+    print(f"Split combined hits into {len(written)} result files in {output_results_folder}")
+    print("\n" + "#@*"* 35 + '\n')
+    return results
+
+
+def write_job_summary(results, summary_path, wall_time, threads):
+    """
+    writes one line per DIAMOND job (type, genome, threads, start time, wall time, exit code and 
+    log file) and the total time of each job type to summary_path, and prints the totals
+
+    """
+    failed = [result["name"] for result in results if result["returncode"] != 0]
+    with open(summary_path, "w") as summary_file:
+        summary_file.write(f"# {len(results)} DIAMOND job(s) in {format_elapsed(wall_time)} with {threads} thread(s) total\n")
+        summary_file.write("Job\tType\tGenome\tThreads\tStarted\tElapsed (s)\tExit\tLog\n")
+        for result in results:
+            summary_file.write(f"{result['name']}\t{result['kind']}\t{result['genome']}\t{result['threads']}\t{result['started']}\t"
+                               f"{result['elapsed']:.2f}\t{result['returncode']}\t{result['log'] or '-'}\n")
+        for kind in ["makedb", "cached", "blastp"]:
+            kind_results = [result for result in results if result["kind"] == kind]
+            if kind_results:
+                summary_file.write(f"# {kind}: {len(kind_results)} job(s), {sum(result['elapsed'] for result in kind_results):.2f}s total\n")
+    print(f"All jobs completed in {format_elapsed(wall_time)}: {len(results) - len(failed)} succeeded, {len(failed)} failed.")
+    for name in failed:
+        print(f"\tfailed: {name}")
+    print(f"Per job timings saved to {summary_path}")
+
+
+def print_job_result(result, progress=""):
+    """
+    prints the messages of a finished job and its status line (after the progress counts) in one print
+
+    """
+    if result["kind"] == "cached":
+        status = "up to date (cached)"
+    else:
+        status = "finished" if result["returncode"] == 0 else f"FAILED (exit {result['returncode']})"
+    print("\n".join(result["messages"] + [f"{progress}{result['name']} {status} in {format_elapsed(result['elapsed'])}"]))
+
+
+def write_tagged_fasta(fasta_paths, output_path):
+    """
+    concatenates fasta files into output_path, with the index of the file they came from 
+    added in front of every id (e.g. >3|APNARBLE_CDS_0211). 
+    returns the number of sequence letters of each file
+
+    """
+    letters = []
+    with open(output_path, "w") as out_file:
+        for index, fasta_path in enumerate(fasta_paths):
+            file_letters = 0
+            with open(fasta_path, "r") as fasta_file:
+                line = ""
+                for line in fasta_file:
+                    if line.startswith(">"):
+                        line = f">{index}|{line[1:].lstrip()}"
+                    else:
+                        file_letters += len(line.strip())
+                    out_file.write(line)
+                if line and not line.endswith("\n"):
+                    out_file.write("\n")
+            letters.append(file_letters)
+    return letters
+
+
+def split_combined_hits(combined_hits, target_groups, genomes, genome_letters, output_results_folder, search=SEARCH):
+    """
+    splits the tagged combined DIAMOND hits into one <target>_<genome>.tsv per target file and 
+    genome (with the original ids). e-values are scaled to the genome's own database size and 
+    hits above the search e-value dropped, then the top max_target_seqs subjects of each query 
+    are kept per genome (all if 0). target/genome pairs without hits get no file. 
+    returns the written files as (target name, genome, path)
+
+    """
+    total_letters = sum(genome_letters)
+    pair_lines, subjects = defaultdict(list), defaultdict(set)
+    with open(combined_hits, "r") as hits_file:
+        # hits of each query are in order of score, so the first subjects of a genome are its top hits
+        for line in hits_file:
+            fields = line.rstrip("\n").split("\t")
+            target_index, query = fields[0].split("|", 1)
+            genome_index, subject = fields[1].split("|", 1)
+            evalue = float(fields[10]) * genome_letters[int(genome_index)] / total_letters
+            if evalue > search["evalue"]:
                 continue
+            top_subjects = subjects[target_index, genome_index, query]
+            if subject not in top_subjects:
+                if search["max_target_seqs"] and len(top_subjects) >= search["max_target_seqs"]:
+                    continue
+                top_subjects.add(subject)
+            fields[0], fields[1], fields[10] = query, subject, format_evalue(fields[10], evalue)
+            pair_lines[int(target_index), int(genome_index)].append("\t".join(fields) + "\n")
+    written = []
+    for (target_index, genome_index), lines in sorted(pair_lines.items()):
+        target, genome = target_group_name(target_groups[target_index][0]), genomes[genome_index][0]
+        output_file = f"{output_results_folder}/{target}_{genome}.tsv"
+        with open(output_file, "w") as out_file:
+            out_file.writelines(lines)
+        written.append((target, genome, output_file))
+    return written
+
+
+def format_evalue(original, evalue):
+    """
+    formats a scaled e-value with the same number of decimals as the DIAMOND output it came from
+
+    """
+    mantissa = original.lower().split("e")[0]
+    decimals = len(mantissa.split(".")[1]) if "." in mantissa else 0
+    if evalue == 0:
+        return original
+    return f"{evalue:.{decimals}e}"
+
+
+def build_database(fasta_path, database_path, db_cache, db_cache_path, threads, log_dir, genome):
+    """
+    Builds the DIAMOND database of a proteome, unless the cache shows it was already built from 
+    the same proteome (md5 checksum) with the same DIAMOND version. returns the job result 
+    (kind "cached" if the database was reused), the database is ready if its returncode is 0
 
-            # Iterate through target genes .fasta files found
-            target_gene_match(target_genes, output_results_folder, database_path, db)
-
-
-def target_gene_match(target_genes, output_results_folder, database_path, db): 
-    for target_gene_group in os.listdir(target_genes):
-        target_genes_path = os.path.join(target_genes, target_gene_group)
-        if not target_genes_path.endswith(".fasta"): 
-            print(f"[skip] {target_genes_path} is not a .fasta file")
-            print("\n" + "#@*"* 35 + '\n')
-            continue 
-        print(f"Processing target genes: {target_gene_group}")
-        output_file = f"{output_results_folder}/{str(target_gene_group).strip(".fasta")}_{db}.tsv"
-        command = ["diamond", "blastp", "-d", database_path, "-q", target_genes_path, "-o", output_file, "--query-cover", str(QUERY_COVER_THRESH), "--subject-cover", str(QUERY_COVER_THRESH), "--max-target-seqs", "5", "--outfmt", "6", "qseqid", "sseqid", "pident", "length", "mismatch", "gapopen", "qstart", "qend", "sstart", "send", "evalue", "bitscore", "qlen", "slen"]
-        try:
-            result = subprocess.run(command, check=True)
-            print(f"{target_gene_group} blastped successfully against {db}!\n")
-            if os.path.getsize(output_file)== 0: 
-                command = ["rm", output_file]
-                try: 
-                    subprocess.run(command, check=True)
-                except subprocess.CalledProcessError as e: 
-                    print(f"Problem deleting file {output_file}")
-            else: 
-                print(f"Results saved to {output_file}")                    
-        except subprocess.CalledProcessError as e:
-            print(f"There was an error blastping {target_gene_group} against {database_path}.\n")
-            print(e)
-            print("\n" + "#@*"* 35 + '\n')
+    """
+    name = os.path.basename(database_path)
+    checksum = file_checksum(fasta_path)
+    with DB_CACHE_LOCK:
+        entry = db_cache["databases"].get(name)
+    if entry and entry["md5"] == checksum and entry["diamond_version"] == db_cache["diamond_version"] and os.path.exists(database_path):
+        return {"name": f"makedb_{genome}", "kind": "cached", "genome": genome, "command": [], "threads": 0, "returncode": 0,
+                "started": timestamp(), "elapsed": 0.0, "log": None, "messages": [f"{name} is up to date (built {entry['built']}), reusing it"]}
+    command = ["diamond", "makedb", "--in", fasta_path, "-d", database_path]
+    result = run_diamond_job(f"makedb_{genome}", "makedb", genome, command, threads, log_dir)
+    # jobs finish in any order, so the cache is only changed and saved by one job at a time
+    with DB_CACHE_LOCK:
+        if result["returncode"] == 0:
+            result["messages"].append(f"{name} created successfully!")
+            db_cache["databases"][name] = {"source": os.path.abspath(fasta_path), "md5": checksum, "diamond_version": db_cache["diamond_version"], "built": timestamp()}
+        else:
+            result["messages"].append(f"There was an error creating database {name}, see {result['log']}")
+            db_cache["databases"].pop(name, None)
+        save_db_cache(db_cache, db_cache_path)
+    return result
+
+
+def prune_databases(output_folder):
+    """
+    Removes the .dmnd files in <output_folder>/databases that are orphaned: not in the database 
+    cache, or whose source proteome is gone or has changed since the database was built
+
+    """
+    databases_dir = os.path.join(output_folder, "databases")
+    db_cache_path = os.path.join(databases_dir, DB_CACHE_NAME)
+    if not os.path.isdir(databases_dir):
+        sys.exit(f"No databases folder found in {output_folder}")
+    db_cache = load_db_cache(db_cache_path)
+    removed, kept = 0, 0
+    for name in sorted(os.listdir(databases_dir)):
+        if not name.endswith(".dmnd"):
             continue
+        entry = db_cache["databases"].get(name)
+        if entry is None:
+            reason = "not in the database cache"
+        elif not os.path.exists(entry["source"]):
+            reason = f"source proteome {entry['source']} is gone"
+        elif file_checksum(entry["source"]) != entry["md5"]:
+            reason = f"source proteome {entry['source']} has changed"
+        else:
+            kept += 1
+            continue
+        os.remove(os.path.join(databases_dir, name))
+        db_cache["databases"].pop(name, None)
+        removed += 1
+        print(f"removed {name}: {reason}")
+    # forget cache entries whose database file was deleted by hand
+    for name in [name for name in db_cache["databases"] if not os.path.exists(os.path.join(databases_dir, name))]:
+        db_cache["databases"].pop(name)
+    save_db_cache(db_cache, db_cache_path)
+    print(f"\n{removed} database(s) removed, {kept} up to date database(s) kept")
+
+
+def load_db_cache(db_cache_path):
+    """
+    Load the database cache, or start a new one if there is none yet
+
+    """
+    if os.path.exists(db_cache_path):
+        with open(db_cache_path, "r") as cache_file:
+            return json.load(cache_file)
+    return {"diamond_version": None, "databases": {}}
+
+
+def save_db_cache(db_cache, db_cache_path):
+    """
+    Write the database cache (write to a temp file, then rename so it is never left half written)
+
+    """
+    with open(db_cache_path + ".tmp", "w") as cache_file:
+        json.dump(db_cache, cache_file, indent=2)
+    os.replace(db_cache_path + ".tmp", db_cache_path)
+
+
+def diamond_version():
+    """
+    version string of the installed DIAMOND (databases built by another version are rebuilt)
+
+    """
+    try:
+        result = subprocess.run(["diamond", "version"], check=True, capture_output=True, text=True)
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return "unknown"
+    return result.stdout.strip().split()[-1] if result.stdout.strip() else "unknown"
+
+
+def file_checksum(path):
+    """
+    md5 checksum of a file
+
+    """
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def format_elapsed(seconds):
+    """
+    format a number of seconds as h:mm:ss
+
+    """
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+def timestamp():
+    """
+    current local time for the database cache and job summary
+
+    """
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def target_group_name(target_gene_group):
+    """
+    name of a target gene file used in the result file names 
+    (strip removes the characters of ".fasta" from both ends, kept for the existing file names)
 
-        print("\n" + "#@*"* 35 + '\n')
+    """
+    return str(target_gene_group).strip('.fasta')
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="use DIAMOND to find top hit proteins for each target gene from reference fasta files")
 
-    parser.add_argument("--target_genes", required=True, help="Path to the folder with subdirectories containing .fasta files with reference target genes as queries.")
-    parser.add_argument("--genomes_path", required=True, help="Path to genomes, all in .faa or .fasta format with all proteins")
-    parser.add_argument("--output_folder", required=True, help="Path to the output folder where results will be saved.")
-    parser.add_argument("--prefix", required=True, help="Prefix for output subdirectory")
+    parser.add_argument("--target_genes", help="Path to the folder with subdirectories containing .fasta files with reference target genes as queries.")
+    parser.add_argument("--genomes_path", help="Path to genomes, all in .faa or .fasta format with all proteins")
+    parser.add_argument("--output_folder", help="Path to the output folder where results will be saved.")
+    parser.add_argument("--prefix", help="Prefix for output subdirectory")
+    parser.add_argument("--combined", action="store_true", help="Search all proteomes as one combined database with one diamond blastp run, and split the hits into the same per target/per genome TSVs.")
+    parser.add_argument("--threads", type=int, default=None, help="Total number of threads shared by all running DIAMOND jobs (default: all cpus).")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of DIAMOND jobs (makedb/blastp) to run at once (default: 1).")
+    parser.add_argument("--raw", action="store_true", help="Search with permissive settings (no coverage cutoff, all hits up to e-value 1) and cache the raw hits in <output_folder>/<prefix>_raw_hits.npz for filter_depol_hits.py; the usual TSVs are written from the cache with the default thresholds.")
+    parser.add_argument("--prune", action="store_true", help="Only remove orphaned databases from <output_folder>/databases (needs --output_folder), nothing is searched.")
     # if all 4 arguments are not provided, print help message
     if len(sys.argv) < 2:
         parser.print_help(sys.stderr)
@@ -94,5 +509,12 @@ if __name__ == "__main__":
         sys.exit(1)
     args = parser.parse_args()
 
-    get_top_hits(args.target_genes, args.genomes_path, args.output_folder, args.prefix)
+    if args.prune:
+        if not args.output_folder:
+            parser.error("--prune needs --output_folder")
+        prune_databases(args.output_folder)
+        sys.exit(0)
+    if not (args.target_genes and args.genomes_path and args.output_folder and args.prefix):
+        parser.error("--target_genes, --genomes_path, --output_folder and --prefix are required")
 
+    get_top_hits(args.target_genes, args.genomes_path, args.output_folder, args.prefix, args.combined, args.threads, args.jobs, args.raw)
@@ -0,0 +1,316 @@
+import os
+import re
+
+
+SEQUENCE_DELETE = str.maketrans("", "", "0123456789 \t\n\r")
+COMPLEMENT = str.maketrans("ACGTURYKMBVDHNacgturykmbvdhn", "TGCAAYRMKVBHDNtgcaayrmkvbhdn")
+SINGLE_POSITION = re.compile(r"<?(\d+)")
+RANGE_POSITION = re.compile(r"<?(\d+)\.\.>?(\d+)")
+BETWEEN_POSITION = re.compile(r"(\d+)\^(\d+)")
+CDS_KEY = "     CDS "
+QUALIFIER_INDENT = " " * 21
+MAX_WIDTH = 80 # line width of qualifiers written by format_qualifier (as SeqIO.write)
+WRITE_BUFFER = 1024 * 1024 # patched files are written in blocks of 1 MB
+
+
+def scan_cds(gbk_path, qualifiers=None, sequence=False):
+    """
+    Streams a GenBank file and yields one dictionary per CDS feature, without building
+    SeqRecord/SeqFeature objects or parsing any other feature type:
+        record_id   id of the record (same as SeqIO record.id)
+        start, end  0-based start and end of the CDS (same as feature.location.start/end)
+        strand      1, -1 (None if the parts of a join are on both strands)
+        parts       list of (start, end, strand) parts, in the order they are read
+        qualifiers  library of qualifier name -> list of values (same as feature.qualifiers)
+        sequence    nucleotide sequence of the CDS (only if sequence=True)
+    qualifiers: names of the qualifiers to keep (None keeps all), the others are skipped
+    without joining their lines (e.g. leave out "translation" if it is not needed)
+    sequence: the ORIGIN block is only read if sequence=True, otherwise it is skipped
+
+    """
+    keep = None if qualifiers is None else set(qualifiers)
+    with open(gbk_path, "r") as gbk_file:
+        for record_id, features, record_seq in scan_records(gbk_file, keep, sequence):
+            for location, quals in features:
+                parts = parse_location(location)
+                strands = {part[2] for part in parts}
+                cds = {
+                    "record_id": record_id,
+                    "start": min(part[0] for part in parts) if parts else 0,
+                    "end": max(part[1] for part in parts) if parts else 0,
+                    "strand": strands.pop() if len(strands) == 1 else None,
+                    "parts": parts,
+                    "qualifiers": quals,
+                }
+                if sequence:
+                    cds["sequence"] = extract_sequence(record_seq, parts)
+                yield cds
+
+
+def scan_records(gbk_file, keep, sequence):
+    """
+    yields (record_id, list of (location, qualifiers) for the CDS features, sequence) for every
+    record in an open GenBank file. the sequence is "" unless sequence=True
+
+    """
+    record_id, accession, version = None, None, None
+    features, seq_lines, cds_lines = [], [], None
+    in_features = in_origin = False
+    for line in gbk_file:
+        if in_origin:
+            if not line.startswith("//"):
+                if sequence:
+                    seq_lines.append(line)
+                continue
+            in_origin = False
+        elif cds_lines is not None:
+            # qualifier lines of the current CDS, until the next feature
+            if line.startswith(QUALIFIER_INDENT) or not line.strip():
+                cds_lines.append(line)
+                continue
+            features.append(parse_feature(cds_lines, keep))
+            cds_lines = None
+        if in_features and line.startswith(" "):
+            if line.startswith(CDS_KEY):
+                cds_lines = [line]
+            continue # other feature types and their qualifiers are skipped
+        in_features = False
+        if line.startswith("//"):
+            seq = "".join(seq_lines).translate(SEQUENCE_DELETE).upper() if sequence else ""
+            yield version or accession or record_id, features, seq
+            record_id, accession, version = None, None, None
+            features, seq_lines = [], []
+        elif line.startswith("LOCUS"):
+            fields = line.split()
+            record_id = fields[1] if len(fields) > 1 else ""
+        elif line.startswith("ACCESSION"):
+            fields = line.split()
+            accession = accession or (fields[1] if len(fields) > 1 else None)
+        elif line.startswith("VERSION"):
+            fields = line.split()
+            version = fields[1] if len(fields) > 1 else None
+        elif line.startswith("FEATURES"):
+            in_features = True
+        elif line.startswith("ORIGIN"):
+            in_origin = True
+
+
+def parse_feature(feature_lines, keep):
+    """
+    parses the lines of one feature into its full location and a library of qualifier values, 
+    joining wrapped lines like Biopython does (with a space, and without whitespace for translations)
+
+    """
+    location = feature_lines[0][21:].strip()
+    lines = [stripped for stripped in (line[21:].strip() for line in feature_lines[1:]) if stripped]
+    # wrapped locations end with a comma or have unclosed brackets
+    i = 0
+    while i < len(lines) and (location.endswith(",") or location.count("(") > location.count(")") or lines[i].startswith(")")):
+        location += lines[i]
+        i += 1
+    quals, key, value_lines, in_quote = {}, None, None, False
+    for line in lines[i:]:
+        if in_quote:
+            # a quoted value runs until a line that ends with a quote
+            if key is not None:
+                value_lines.append(line)
+            in_quote = not line.endswith('"')
+        elif line[0] == "/":
+            if key is not None:
+                add_qualifier(quals, key, value_lines)
+            name, eq, value = line[1:].partition("=")
+            key = name if keep is None or name in keep else None
+            value_lines = [value] if eq else None
+            in_quote = eq and value.startswith('"') and value != '"' and not value.endswith('"')
+        elif key is not None and value_lines is not None:
+            value_lines.append(line) # unquoted continuation
+    if key is not None:
+        add_qualifier(quals, key, value_lines)
+    return location, quals
+
+
+def add_qualifier(quals, key, value_lines):
+    """
+    adds one qualifier value (list of its lines, None for a qualifier without a value like /pseudo)
+
+    """
+    if value_lines is None:
+        quals.setdefault(key, [""])
+        return
+    value = " ".join(value_lines)
+    if len(value) > 1 and value[0] == '"' and value[-1] == '"':
+        value = value[1:-1]
+    value = value.replace('""', '"')
+    if key == "translation":
+        value = "".join(value.split())
+    quals.setdefault(key, []).append(value)
+
+
+def patch_cds(gbk_path, output_path, edit):
+    """
+    Copies a GenBank file to output_path line by line, passing the qualifiers of every CDS
+    feature to edit(blocks). a block is (name, value, lines) for one qualifier: its name, its
+    value (joined as in scan_cds, "" for a qualifier without a value) and its original lines.
+    edit returns the new list of blocks (new qualifiers can be made with format_qualifier), or
+    None to leave the CDS as it is. every other line, including the ORIGIN sequence, is copied
+    unchanged, so the output only differs from the input in the edited qualifiers. the output is
+    written to a temporary file that replaces output_path once the whole file is done.
+    returns the number of CDS features that were edited
+
+    """
+    edited = 0
+    temp_path = f"{output_path}.tmp"
+    try:
+        with open(gbk_path, "r") as gbk_file, open(temp_path, "w", buffering=WRITE_BUFFER) as out_file:
+            in_features, cds_lines = False, None
+            for line in gbk_file:
+                if cds_lines is not None:
+                    if line.startswith(QUALIFIER_INDENT) or not line.strip():
+                        cds_lines.append(line)
+                        continue
+                    edited += patch_feature(cds_lines, edit, out_file)
+                    cds_lines = None
+                if in_features and line.startswith(" "):
+                    if line.startswith(CDS_KEY):
+                        cds_lines = [line]
+                        continue
+                else:
+                    in_features = line.startswith("FEATURES")
+                out_file.write(line)
+            if cds_lines is not None:
+                edited += patch_feature(cds_lines, edit, out_file)
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path): # only left if the patch failed
+            os.remove(temp_path)
+    return edited
+
+
+def patch_feature(feature_lines, edit, out_file):
+    """
+    writes the lines of one CDS feature with the qualifier blocks returned by edit.
+    returns 1 if the CDS was edited, 0 if edit returned None
+
+    """
+    location_lines, blocks = split_qualifier_blocks(feature_lines)
+    new_blocks = edit(blocks)
+    if new_blocks is None:
+        out_file.writelines(feature_lines)
+        return 0
+    out_file.writelines(location_lines)
+    for _, _, lines in new_blocks:
+        out_file.writelines(lines)
+    return 1
+
+
+def split_qualifier_blocks(feature_lines):
+    """
+    splits the lines of one feature into its location lines and one (name, value, lines) block
+    per qualifier, with the same rules for wrapped locations and values as parse_feature
+
+    """
+    location = feature_lines[0][21:].strip()
+    i = 1
+    while i < len(feature_lines) and (location.endswith(",") or location.count("(") > location.count(")") or feature_lines[i][21:].strip().startswith(")")):
+        location += feature_lines[i][21:].strip()
+        i += 1
+    location_lines, blocks, in_quote = feature_lines[:i], [], False
+    for line in feature_lines[i:]:
+        stripped = line[21:].strip()
+        if not in_quote and stripped.startswith("/"):
+            name, eq, value = stripped[1:].partition("=")
+            blocks.append((name, [value] if eq else None, [line]))
+            in_quote = eq and value.startswith('"') and value != '"' and not value.endswith('"')
+        elif blocks:
+            blocks[-1][2].append(line)
+            if stripped and blocks[-1][1] is not None:
+                blocks[-1][1].append(stripped)
+                in_quote = in_quote and not stripped.endswith('"')
+        else:
+            location_lines.append(line)
+    qualifier_blocks = []
+    for name, value_lines, lines in blocks:
+        quals = {}
+        add_qualifier(quals, name, value_lines)
+        qualifier_blocks.append((name, quals[name][0], lines))
+    return location_lines, qualifier_blocks
+
+
+def format_qualifier(name, value, quote=True):
+    """
+    returns the lines of a new qualifier, quoted (or not, e.g. for numbers) and wrapped at
+    MAX_WIDTH the same way SeqIO.write does
+
+    """
+    if quote:
+        line = f'{QUALIFIER_INDENT}/{name}="{str(value).replace(chr(34), chr(34) * 2)}"'
+    else:
+        line = f"{QUALIFIER_INDENT}/{name}={value}"
+    lines = []
+    while len(line) > MAX_WIDTH:
+        # break at the last space that fits, or at MAX_WIDTH if there is none
+        index = next((i for i in range(min(len(line) - 1, MAX_WIDTH), len(QUALIFIER_INDENT) + 1, -1) if line[i] == " "), MAX_WIDTH)
+        lines.append(line[:index] + "\n")
+        line = QUALIFIER_INDENT + line[index:].lstrip()
+    if line.strip():
+        lines.append(line + "\n")
+    return lines
+
+
+def parse_location(location):
+    """
+    parses a GenBank location string (e.g. "complement(join(490883..490885,1..879))")
+    into a list of 0-based (start, end, strand) parts. parts on other records are skipped
+
+    """
+    if location.startswith("complement(") and location.endswith(")"):
+        return [(start, end, -strand) for start, end, strand in reversed(parse_location(location[11:-1]))]
+    if location.startswith(("join(", "order(")) and location.endswith(")"):
+        parts = []
+        for piece in split_location(location[location.index("(") + 1:-1]):
+            parts.extend(parse_location(piece))
+        return parts
+    if ":" in location:
+        return []
+    match = RANGE_POSITION.fullmatch(location)
+    if match:
+        return [(int(match.group(1)) - 1, int(match.group(2)), 1)]
+    match = BETWEEN_POSITION.fullmatch(location)
+    if match:
+        return [(int(match.group(1)), int(match.group(1)), 1)]
+    match = SINGLE_POSITION.fullmatch(location.rstrip(">"))
+    if match:
+        return [(int(match.group(1)) - 1, int(match.group(1)), 1)]
+    return []
+
+
+def split_location(location):
+    """
+    splits the inside of a join/order on the commas that are not inside brackets
+
+    """
+    pieces, depth, begin = [], 0, 0
+    for i, char in enumerate(location):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            pieces.append(location[begin:i].strip())
+            begin = i + 1
+    pieces.append(location[begin:].strip())
+    return pieces
+
+
+def extract_sequence(record_seq, parts):
+    """
+    returns the nucleotide sequence of the parts (reverse complement for the - strand)
+
+    """
+    sequence = []
+    for start, end, strand in parts:
+        part_seq = record_seq[start:end]
+        if strand == -1:
+            part_seq = part_seq.translate(COMPLEMENT)[::-1]
+        sequence.append(part_seq)
+    return "".join(sequence)
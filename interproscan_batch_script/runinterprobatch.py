@@ -3,21 +3,38 @@ import subprocess
 import os
 import argparse 
 import sys
+import shutil
+import time
+import json
+import hashlib
+import threading
+import sqlite3
+import zlib
+import heapq
+from collections import Counter
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def run_interproscan_batch(input_folder, prefix, output_folder, interpro_path):
+MANIFEST_NAME = "interpro_manifest.json"
+MANIFEST_LOCK = threading.Lock()
+KMER_SIZE = 5 # k-mer length used to compare proteins when clustering
+SKETCH_SIZE = 32 # number of smallest k-mer hashes kept per protein to find cluster candidates
+MIN_SHARED_SKETCH = 2 # sketch hashes two proteins must share to be compared
+
+
+def run_interproscan_batch(input_folder, prefix, output_folder, interpro_path, cpus=None, jobs=1, shard_size=0, retries=1, cache_path=None, cache_size_mb=1024, cluster_identity=None):
     """
-    Run interproscan on all aa.fasta files in the given folder
+    Run interproscan on all aa.fasta files in the given folder,
+    with up to `jobs` interproscan runs at once sharing `cpus` cores.
+    if shard_size is set, each proteome is split into shards of that many
+    proteins that run as separate jobs and are merged back per genome.
+    if cache_path is set, only proteins missing from the protein md5 result 
+    cache are scanned and the genome TSVs are rebuilt from the cache.
+    if cluster_identity is set, proteins of all genomes are clustered first
+    and only one representative per cluster is scanned
     
     """
-    # Find all aa.fasta files in the input folder with the specified prefix
-    aa_files = []
-    for folder in os.listdir(input_folder):
-        if folder.startswith(prefix) and folder.endswith("predict") and os.path.isdir(os.path.join(input_folder, folder)):
-            Predict_path = os.path.join(input_folder, folder)
-            # print(f"Processing folder: {Predict_path}")
-            for filename in os.listdir(Predict_path):
-                if filename.endswith("aa.fasta") and filename.startswith(prefix):
-                    aa_files.append(os.path.join(Predict_path, filename))
+    aa_files = find_aa_files(input_folder, prefix)
     print(f"\nFound {len(aa_files)} .aa files with prefix '{prefix}' in '{input_folder}'.\n")
     print(f"Files found:\n")
     # Print the list of found files
@@ -25,22 +42,676 @@ def run_interproscan_batch(input_folder, prefix, output_folder, interpro_path):
         print(file)
     print("-"*50)
     
-    # Run interproscan on each aa.fasta file
+    # one output dir per aa.fasta file, with one interproscan task per genome (or per shard)
     os.makedirs(os.path.join(output_folder, prefix,), exist_ok=True)
+    manifest_path = os.path.join(output_folder, prefix, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    # results cached by another InterProScan version are not used
+    cache = open_cache(cache_path, interproscan_version(interpro_path)) if cache_path else None
+    cache_stats = {"hits": 0, "misses": 0, "added": 0, "evicted": 0}
+    genomes, skipped = [], []
     for aa_file in aa_files:
-        print(f"\nRunning interproscan on {aa_file}")
-        # Call interproscan command here
-        command = [interpro_path, "-i", aa_file, "-d", os.path.join(output_folder, prefix, os.path.basename(aa_file).replace("aa.fasta", "")), "-tempdir", os.path.join(output_folder, prefix, os.path.basename(aa_file).replace("aa.fasta", ""), "TEMP")]
-        print(f"\nRunning command: {command}\n")
-        command2 = ["rm", "-rf", os.path.join(output_folder, prefix, os.path.basename(aa_file).replace("aa.fasta", ""), "TEMP")]
-        try:
-            result = subprocess.run(command, check=True)
-            print("InterProScan ran successfully!")
-            subprocess.run(command2, check=True)
-            print("Temporary files removed successfully!")
-        except subprocess.CalledProcessError as e:
-            print("There was an error running InterProScan.")
-            print(e)
+        out_dir = os.path.join(output_folder, prefix, os.path.basename(aa_file).replace("aa.fasta", ""))
+        genome = {
+            "name": os.path.basename(aa_file),
+            "aa_file": aa_file,
+            "out_dir": out_dir,
+            "tsv": os.path.join(out_dir, os.path.basename(aa_file) + ".tsv"),
+            "checksum": file_checksum(aa_file),
+            "scan_input": aa_file,
+            "scan_tsv": os.path.join(out_dir, os.path.basename(aa_file) + ".tsv"),
+        }
+        # skip genomes whose input is unchanged and whose output is complete
+        entry = manifest["genomes"].setdefault(genome["name"], {})
+        if entry_is_done(entry, genome["checksum"], genome["tsv"]):
+            skipped.append(genome["name"])
+            continue
+        if entry.get("checksum") != genome["checksum"]:
+            # input changed, earlier shard/scan results do not apply
+            entry.pop("shards", None)
+            entry.pop("scan", None)
+        entry.update({"aa_file": aa_file, "checksum": genome["checksum"], "tsv": genome["tsv"], "status": "pending"})
+        genome["entry"] = entry
+        genomes.append(genome)
+
+    # with the cache or clustering on, each genome only scans its uncached cluster representatives
+    clusters, rep_owners = {}, {}
+    if cache or cluster_identity:
+        clusters, rep_owners = plan_scan_inputs(genomes, cache, cache_stats, cluster_identity)
+    for genome in genomes:
+        entry = genome["entry"]
+        if genome.get("to_scan") == 0:
+            genome["tasks"] = []
+        elif shard_size:
+            genome["tasks"] = create_shard_tasks(genome, shard_size)
+        else:
+            entry.pop("shards", None)
+            # a scan of only part of the proteome is tracked separately from the genome's final TSV
+            scan_entry = entry.setdefault("scan", {}) if genome["scan_input"] != genome["aa_file"] else entry
+            scan_dir = os.path.dirname(genome["scan_tsv"])
+            genome["tasks"] = [{"name": genome["name"], "input": genome["scan_input"], "out_dir": scan_dir, "temp_dir": os.path.join(scan_dir, "TEMP"),
+                                "tsv": genome["scan_tsv"], "checksum": file_checksum(genome["scan_input"]), "entry": scan_entry}]
+    save_manifest(manifest, manifest_path)
+    if skipped:
+        print(f"\nSkipping {len(skipped)} genome(s) already completed with unchanged input (see {manifest_path}).")
+
+    # shards that already finished in an earlier run are not run again
+    tasks = [task for genome in genomes for task in genome["tasks"] if not entry_is_done(task["entry"], task["checksum"], task["tsv"])]
+    if shard_size:
+        print(f"\nSplit {len(genomes)} genome(s) into {sum(len(genome['tasks']) for genome in genomes)} shard(s) of up to {shard_size} proteins, {len(tasks)} still to run.")
+
+    # run all tasks, then retry only the failed ones
+    scanned_rows, read_tsvs = {}, set()
+    for attempt in range(retries + 1):
+        if attempt:
+            print(f"\nRetrying {len(tasks)} failed job(s) (retry {attempt} of {retries}).")
+        results = schedule_jobs(tasks, interpro_path, cpus, jobs, manifest_path, manifest)
+        tasks = [result["task"] for result in results if result["returncode"] != 0]
+        # add new results to the cache as soon as they are in, so finished work is kept even if others fail
+        for result in results:
+            if result["returncode"] == 0 and (cache or cluster_identity):
+                rows = read_scan_rows(result["task"]["input"], result["task"]["tsv"])
+                read_tsvs.add(result["task"]["tsv"])
+                if cache:
+                    cache_stats["added"] += cache_store(cache, rows)
+                else:
+                    scanned_rows.update(rows)
+        if not tasks:
+            break
+
+    if cache or cluster_identity:
+        # results of tasks that finished in an earlier run are read back from their TSVs
+        # (with a cache too, the run may have stopped before they were stored, or the cache was cleared)
+        for genome in genomes:
+            for task in genome["tasks"]:
+                if task["entry"].get("status") == "done" and task["tsv"] not in read_tsvs:
+                    rows = read_scan_rows(task["input"], task["tsv"])
+                    if cache:
+                        cache_stats["added"] += cache_store(cache, rows)
+                    else:
+                        scanned_rows.update(rows)
+        for genome in genomes:
+            write_genome_tsv(genome, scanned_rows, cache, clusters, rep_owners)
+        if cache:
+            cache_stats["evicted"] = cache_evict(cache, cache_size_mb * 1024 * 1024)
+            print_cache_stats(cache, cache_path, cache_stats, cache_size_mb)
+            cache.close()
+    elif shard_size:
+        for genome in genomes:
+            merge_shard_tsvs(genome)
+    save_manifest(manifest, manifest_path)
+
+
+def create_shard_tasks(genome, shard_size):
+    """
+    Split the genome proteome into shards of shard_size proteins and return one task per shard.
+    shard fasta files are only rewritten (and their old results removed) if their content changed
+
+    """
+    shards_dir = os.path.join(genome["out_dir"], "shards")
+    os.makedirs(shards_dir, exist_ok=True)
+    proteins = read_fasta(genome["scan_input"])
+    stem = genome["name"].replace(".fasta", "")
+    tasks = []
+    for n, i in enumerate(range(0, len(proteins), shard_size)):
+        shard_name = f"{stem}_shard_{n:03d}"
+        shard_fasta = os.path.join(shards_dir, f"{shard_name}.fasta")
+        shard_out_dir = os.path.join(shards_dir, shard_name)
+        content = "".join(f">{header}\n{seq}\n" for header, seq in proteins[i:i + shard_size])
+        old_content = None
+        if os.path.exists(shard_fasta):
+            with open(shard_fasta, "r") as shard_file:
+                old_content = shard_file.read()
+        if old_content != content:
+            shutil.rmtree(shard_out_dir, ignore_errors=True)
+            with open(shard_fasta, "w") as shard_file:
+                shard_file.write(content)
+        tasks.append({
+            "name": f"{genome['name']} shard {n + 1}",
+            "input": shard_fasta,
+            "out_dir": shard_out_dir,
+            "temp_dir": os.path.join(shard_out_dir, "TEMP"),
+            "tsv": os.path.join(shard_out_dir, f"{shard_name}.fasta.tsv"),
+            "checksum": file_checksum(shard_fasta),
+            "entry": genome["entry"].setdefault("shards", {}).setdefault(shard_name, {}),
+        })
+    # remove leftover shards from an earlier split of a larger proteome
+    keep = {os.path.basename(task["input"]) for task in tasks} | {os.path.basename(task["out_dir"]) for task in tasks}
+    for leftover in os.listdir(shards_dir):
+        if leftover not in keep:
+            leftover_path = os.path.join(shards_dir, leftover)
+            if os.path.isdir(leftover_path):
+                shutil.rmtree(leftover_path)
+            else:
+                os.remove(leftover_path)
+    return tasks
+
+
+def merge_shard_tsvs(genome):
+    """
+    Concatenate the shard TSVs (in shard order) into the single per-genome TSV
+    that combineSPHAEinterpro.py expects
+
+    """
+    missing = [task["name"] for task in genome["tasks"] if task["entry"].get("status") != "done"]
+    if missing:
+        genome["entry"]["status"] = "incomplete"
+        print(f"\nNot merging {genome['name']}: {len(missing)} shard(s) did not finish, rerun to retry them.")
+        return None
+    with open(genome["scan_tsv"], "w") as merged:
+        for task in genome["tasks"]:
+            # a shard with no hits may produce no (or an empty) tsv
+            if os.path.exists(task["tsv"]):
+                with open(task["tsv"], "r") as shard_tsv:
+                    shutil.copyfileobj(shard_tsv, merged)
+    genome["entry"].update({"status": "done", "tsv_size": os.path.getsize(genome["scan_tsv"]), "updated": timestamp()})
+    print(f"Merged {len(genome['tasks'])} shard(s) into {genome['scan_tsv']}")
+    return genome["scan_tsv"]
+
+
+def protein_md5(seq):
+    """
+    md5 of a protein sequence, as used by InterProScan (upper case, no stop codon)
+
+    """
+    return hashlib.md5(seq.upper().rstrip("*").encode()).hexdigest()
+
+
+def open_cache(cache_path, interpro_version):
+    """
+    Open (or create) the on-disk protein md5 -> InterProScan rows cache.
+    rows are stored without the protein id column, an empty string means the protein had no hits.
+    the InterProScan version the results were made with is stored in the cache, if it differs from
+    interpro_version (or is unknown) the cached results are removed, with a warning
+
+    """
+    if os.path.dirname(cache_path):
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    cache = sqlite3.connect(cache_path)
+    cache.execute("CREATE TABLE IF NOT EXISTS results (md5 TEXT PRIMARY KEY, rows TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)")
+    cache.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+    cache.execute("CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    row = cache.execute("SELECT value FROM metadata WHERE key = 'interproscan_version'").fetchone()
+    cached_version = row[0] if row else None
+    if cached_version != interpro_version:
+        count = cache.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        if count:
+            print(f"\n[warn] {cache_path} holds results of {cached_version or 'an unknown InterProScan version'}, but {interpro_version} is used now. "
+                  f"The {count} cached proteins are removed and will be scanned again.")
+            cache.execute("DELETE FROM results")
+        cache.execute("INSERT OR REPLACE INTO metadata VALUES ('interproscan_version', ?)", (interpro_version,))
+        cache.commit()
+    return cache
+
+
+def interproscan_version(interpro_path):
+    """
+    version string of the InterProScan install (first line of interproscan.sh --version that
+    names the version), or its resolved path if the version can not be read
+
+    """
+    try:
+        result = subprocess.run([interpro_path, "--version"], check=True, capture_output=True, text=True)
+    except (subprocess.CalledProcessError, OSError):
+        return f"InterProScan at {os.path.realpath(interpro_path)}"
+    lines = [line.strip() for line in result.stdout.splitlines() if "version" in line.lower()]
+    return lines[0] if lines else f"InterProScan at {os.path.realpath(interpro_path)}"
+
+
+def cache_lookup(cache, md5s):
+    """
+    Look up protein md5s in the cache, returns {md5: rows} for the cached ones
+    and marks them as recently used
+
+    """
+    md5s = list(set(md5s))
+    found = {}
+    for i in range(0, len(md5s), 500):
+        chunk = md5s[i:i + 500]
+        placeholders = ",".join("?" * len(chunk))
+        found.update(cache.execute(f"SELECT md5, rows FROM results WHERE md5 IN ({placeholders})", chunk).fetchall())
+        cache.execute(f"UPDATE results SET last_used = ? WHERE md5 IN ({placeholders})", [time.time()] + chunk)
+    cache.commit()
+    return found
+
+
+def read_scan_rows(fasta_path, tsv_path):
+    """
+    Read the InterProScan results of a scanned fasta into {protein md5: [rows without the protein id]},
+    proteins without hits get an empty list
+
+    """
+    ids_to_md5 = {header.split()[0]: protein_md5(seq) for header, seq in read_fasta(fasta_path)}
+    rows = {md5: [] for md5 in ids_to_md5.values()}
+    with open(tsv_path, "r") as tsv_file:
+        for line in tsv_file:
+            protein_id, _, row = line.rstrip("\n").partition("\t")
+            if protein_id in ids_to_md5:
+                rows[ids_to_md5[protein_id]].append(row)
+    return rows
+
+
+def cache_store(cache, rows):
+    """
+    Store InterProScan results ({protein md5: [rows]}) in the cache
+    (proteins without hits are stored too, so they are not scanned again).
+    returns the number of proteins that were not in the cache yet
+
+    """
+    md5s = list(rows)
+    existing = 0
+    for i in range(0, len(md5s), 500):
+        chunk = md5s[i:i + 500]
+        existing += cache.execute(f"SELECT COUNT(*) FROM results WHERE md5 IN ({','.join('?' * len(chunk))})", chunk).fetchone()[0]
+    now = time.time()
+    cache.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                      [(md5, "\n".join(md5_rows), len(md5) + sum(len(row) for row in md5_rows), now) for md5, md5_rows in rows.items()])
+    cache.commit()
+    return len(rows) - existing
+
+
+def cache_evict(cache, max_bytes):
+    """
+    Remove the least recently used proteins until the cache is under max_bytes,
+    returns the number of proteins removed
+
+    """
+    total = cache.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+    evict = []
+    if total > max_bytes:
+        for md5, size in cache.execute("SELECT md5, size FROM results ORDER BY last_used"):
+            if total <= max_bytes:
+                break
+            evict.append((md5,))
+            total -= size
+        cache.executemany("DELETE FROM results WHERE md5 = ?", evict)
+        cache.commit()
+    return len(evict)
+
+
+def print_cache_stats(cache, cache_path, cache_stats, cache_size_mb):
+    """
+    print the cache hit/miss statistics of this run
+
+    """
+    count, size = cache.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+    version = cache.execute("SELECT value FROM metadata WHERE key = 'interproscan_version'").fetchone()[0]
+    looked_up = cache_stats["hits"] + cache_stats["misses"]
+    print("-"*50)
+    print(f"\nCache {cache_path} ({version}):")
+    print(f"\t{cache_stats['hits']} hits, {cache_stats['misses']} misses ({100 * cache_stats['hits'] / looked_up if looked_up else 0:.1f}% of proteins served from the cache)")
+    print(f"\t{cache_stats['added']} proteins added, {cache_stats['evicted']} evicted")
+    print(f"\t{count} proteins cached, {size / 1024 / 1024:.1f} MB of {cache_size_mb} MB")
+
+
+def plan_scan_inputs(genomes, cache, cache_stats, cluster_identity):
+    """
+    Decide which proteins each genome sends to InterProScan and write them
+    to a fasta in the genome's scan/ folder.
+    proteins found in the cache are not scanned. with clustering on, the uncached
+    proteins of all genomes are clustered and each representative is scanned once,
+    by the genome it was first found in.
+    returns {md5: (representative md5, identity)} and {representative md5: (genome, protein id)}
+
+    """
+    uncached = {genome["name"]: {} for genome in genomes}
+    first_seen = {}
+    for genome in genomes:
+        genome["proteins"] = read_fasta(genome["aa_file"])
+        md5s = [protein_md5(seq) for header, seq in genome["proteins"]]
+        cached = cache_lookup(cache, md5s) if cache else {}
+        genome["cache_hits"] = sum(1 for md5 in md5s if md5 in cached)
+        cache_stats["hits"] += genome["cache_hits"]
+        cache_stats["misses"] += len(md5s) - genome["cache_hits"]
+        for (header, seq), md5 in zip(genome["proteins"], md5s):
+            if md5 not in cached:
+                uncached[genome["name"]].setdefault(md5, (header, seq))
+                first_seen.setdefault(md5, (genome["name"], header.split()[0], seq))
+
+    clusters, rep_owners = {}, {}
+    if cluster_identity:
+        start = time.time()
+        clusters = cluster_proteins({md5: seq for md5, (name, protein_id, seq) in first_seen.items()}, cluster_identity)
+        rep_owners = {md5: first_seen[md5][:2] for md5, (rep, identity) in clusters.items() if rep == md5}
+        total = sum(len(genome["proteins"]) - genome["cache_hits"] for genome in genomes)
+        print(f"\nClustered {total} uncached proteins ({len(first_seen)} unique sequences) into {len(rep_owners)} representatives "
+              f"at >= {cluster_identity:.0%} identity in {format_elapsed(time.time() - start)}.\n")
+
+    for genome in genomes:
+        if cluster_identity:
+            to_scan = {md5: uncached[genome["name"]][md5] for md5, owner in rep_owners.items() if owner[0] == genome["name"]}
+        else:
+            to_scan = uncached[genome["name"]]
+        scan_dir = os.path.join(genome["out_dir"], "scan")
+        os.makedirs(scan_dir, exist_ok=True)
+        genome["scan_input"] = os.path.join(scan_dir, genome["name"])
+        genome["scan_tsv"] = genome["scan_input"] + ".tsv"
+        genome["to_scan"] = len(to_scan)
+        with open(genome["scan_input"], "w") as scan_file:
+            for header, seq in to_scan.values():
+                scan_file.write(f">{header}\n{seq}\n")
+        cached_note = f"{genome['cache_hits']} of {len(genome['proteins'])} proteins found in the cache, " if cache else f"{len(genome['proteins'])} proteins, "
+        print(f"{genome['name']}: {cached_note}{len(to_scan)} unique sequence(s) to scan.")
+    return clusters, rep_owners
+
+
+def cluster_proteins(sequences, min_identity):
+    """
+    Greedy clustering of unique protein sequences ({md5: sequence}), longest first.
+    each sequence joins the most similar existing representative with an estimated
+    identity of at least min_identity, or becomes a new representative.
+    candidates are found through shared k-mer sketch hashes (bottom-k minhash),
+    and confirmed with the identity estimated from all shared k-mers.
+    returns {md5: (representative md5, identity)}
+
+    """
+    clusters, sketch_index, rep_kmers = {}, {}, {}
+    for md5, seq in sorted(sequences.items(), key=lambda item: (-len(item[1]), item[0])):
+        kmers = kmer_set(seq)
+        sketch = heapq.nsmallest(SKETCH_SIZE, kmers)
+        best = None
+        if min_identity < 1:
+            shared = Counter(rep for h in sketch for rep in sketch_index.get(h, ()))
+            for rep, count in shared.most_common():
+                if count < MIN_SHARED_SKETCH:
+                    break
+                # representatives are at least as long, skip ones too long to reach the identity
+                if len(seq) < min_identity * len(sequences[rep]):
+                    continue
+                identity = kmer_identity(kmers, rep_kmers[rep])
+                if identity >= min_identity and (best is None or identity > best[1]):
+                    best = (rep, identity)
+        if best:
+            clusters[md5] = (best[0], round(best[1], 4))
+        else:
+            clusters[md5] = (md5, 1.0)
+            rep_kmers[md5] = kmers
+            for h in sketch:
+                sketch_index.setdefault(h, []).append(md5)
+    return clusters
+
+
+def kmer_set(seq):
+    """
+    set of hashed k-mers of a protein sequence (crc32, so it is the same from run to run)
+
+    """
+    seq = seq.upper().rstrip("*")
+    return {zlib.crc32(seq[i:i + KMER_SIZE].encode()) for i in range(len(seq) - KMER_SIZE + 1)}
+
+
+def kmer_identity(kmers1, kmers2):
+    """
+    estimate the identity of two proteins from their shared k-mers:
+    with identity p about p^k of the k-mers are shared, so the shared
+    fraction f = 2J / (1 + J) from the jaccard index J gives p = f^(1/k)
+
+    """
+    union = len(kmers1 | kmers2)
+    if not union:
+        return 0.0
+    jaccard = len(kmers1 & kmers2) / union
+    return (2 * jaccard / (1 + jaccard)) ** (1 / KMER_SIZE)
+
+
+def write_genome_tsv(genome, scanned_rows, cache, clusters, rep_owners):
+    """
+    Rebuild the genome TSV from the scanned and cached rows, with the protein ids of this genome.
+    proteins whose results were copied from a cluster representative in another protein
+    are listed (with the representative and identity) in a <name>.clusters.txt file
+
+    """
+    md5s = [protein_md5(seq) for header, seq in genome["proteins"]]
+    sources = [clusters.get(md5, (md5, 1.0)) for md5 in md5s]
+    needed = {source for source, identity in sources if source not in scanned_rows}
+    cached = {md5: rows.split("\n") if rows else [] for md5, rows in cache_lookup(cache, needed).items()} if cache and needed else {}
+    missing = sum(1 for source, identity in sources if source not in scanned_rows and source not in cached)
+    if missing:
+        genome["entry"]["status"] = "incomplete"
+        print(f"\nNot writing {genome['tsv']}: {missing} protein(s) have no results yet, rerun to retry them.")
+        return None
+    provenance = []
+    with open(genome["tsv"], "w") as tsv_file:
+        for (header, seq), (source, identity) in zip(genome["proteins"], sources):
+            protein_id = header.split()[0]
+            for row in scanned_rows.get(source, cached.get(source)):
+                tsv_file.write(f"{protein_id}\t{row}\n")
+            owner = rep_owners.get(source)
+            if owner and owner != (genome["name"], protein_id):
+                provenance.append(f"{protein_id}\t{owner[1]}\t{owner[0]}\t{identity}\n")
+    provenance_path = os.path.join(genome["out_dir"], genome["name"] + ".clusters.txt")
+    if provenance:
+        with open(provenance_path, "w") as provenance_file:
+            provenance_file.write("protein_id\trepresentative_id\trepresentative_genome\testimated_identity\n")
+            provenance_file.writelines(provenance)
+    elif os.path.exists(provenance_path):
+        os.remove(provenance_path)
+    genome["entry"].update({"status": "done", "tsv_size": os.path.getsize(genome["tsv"]), "updated": timestamp()})
+    return genome["tsv"]
+
+
+def load_manifest(manifest_path):
+    """
+    Load the run manifest, or start a new one if there is none yet
+
+    """
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as manifest_file:
+            return json.load(manifest_file)
+    return {"genomes": {}}
+
+
+def save_manifest(manifest, manifest_path):
+    """
+    Write the run manifest (write to a temp file, then rename so it is never left half written)
+
+    """
+    with MANIFEST_LOCK:
+        with open(manifest_path + ".tmp", "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def file_checksum(path):
+    """
+    md5 checksum of a file
+
+    """
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def entry_is_done(entry, checksum, tsv):
+    """
+    A manifest entry is done if it finished successfully on the same input,
+    and its output TSV is still there with the size recorded when it finished
+
+    """
+    return entry.get("status") == "done" and entry.get("checksum") == checksum and tsv_is_complete(tsv, entry.get("tsv_size"))
+
+
+def tsv_is_complete(tsv, expected_size):
+    """
+    checks that the output TSV exists, has the expected size and is not cut off mid line
+
+    """
+    if expected_size is None or not os.path.exists(tsv) or os.path.getsize(tsv) != expected_size:
+        return False
+    if expected_size == 0:
+        return True
+    with open(tsv, "rb") as tsv_file:
+        tsv_file.seek(-1, os.SEEK_END)
+        return tsv_file.read(1) == b"\n"
+
+
+def print_manifest_status(output_folder, prefix):
+    """
+    Summarize the run manifest without launching anything
+
+    """
+    manifest_path = os.path.join(output_folder, prefix, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        print(f"No manifest found at {manifest_path}")
+        return
+    manifest = load_manifest(manifest_path)
+    counts = {}
+    print(f"\nManifest: {manifest_path}\n")
+    for name, entry in sorted(manifest["genomes"].items()):
+        status = entry.get("status", "pending")
+        # flag genomes whose input or output changed since they were recorded
+        if not os.path.exists(entry.get("aa_file", "")):
+            status += " (input missing)"
+        elif file_checksum(entry["aa_file"]) != entry.get("checksum"):
+            status += " (input changed)"
+        elif entry.get("status") == "done" and not tsv_is_complete(entry.get("tsv", ""), entry.get("tsv_size")):
+            status += " (output incomplete)"
+        counts[status] = counts.get(status, 0) + 1
+        details = []
+        if "shards" in entry:
+            shards_done = sum(1 for shard in entry["shards"].values() if shard.get("status") == "done")
+            details.append(f"shards {shards_done}/{len(entry['shards'])}")
+        job = entry.get("scan", entry)
+        if "returncode" in job:
+            details.append(f"exit {job['returncode']}")
+        if "elapsed" in job:
+            details.append(format_elapsed(job["elapsed"]))
+        if "updated" in entry:
+            details.append(entry["updated"])
+        print(f"{status:<12}\t{name}\t{', '.join(details)}")
+    print("-"*50)
+    print(f"\n{len(manifest['genomes'])} genome(s): " + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+
+
+def read_fasta(fasta_path):
+    """
+    Read a fasta file into a list of (header, sequence) tuples
+
+    """
+    proteins, header, seq = [], None, []
+    with open(fasta_path, "r") as fasta_file:
+        for line in fasta_file:
+            line = line.strip()
+            if line.startswith(">"):
+                if header is not None:
+                    proteins.append((header, "".join(seq)))
+                header, seq = line[1:], []
+            elif line:
+                seq.append(line)
+    if header is not None:
+        proteins.append((header, "".join(seq)))
+    return proteins
+
+
+def find_aa_files(input_folder, prefix):
+    """
+    Find all aa.fasta files in the -predict subdirectories with the specified prefix
+
+    """
+    aa_files = []
+    for folder in sorted(os.listdir(input_folder)):
+        if folder.startswith(prefix) and folder.endswith("predict") and os.path.isdir(os.path.join(input_folder, folder)):
+            Predict_path = os.path.join(input_folder, folder)
+            # print(f"Processing folder: {Predict_path}")
+            for filename in sorted(os.listdir(Predict_path)):
+                if filename.endswith("aa.fasta") and filename.startswith(prefix):
+                    aa_files.append(os.path.join(Predict_path, filename))
+    return aa_files
+
+
+def schedule_jobs(tasks, interpro_path, cpus=None, jobs=1, manifest_path=None, manifest=None):
+    """
+    Run the interproscan tasks concurrently under a total core budget.
+    each running job gets an equal -cpu share of the budget.
+    progress and per-task wall time are reported as jobs finish,
+    and each job's status is recorded in the manifest as it starts and ends
+
+    """
+    if not tasks:
+        return []
+    cpus = cpus or os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(tasks), cpus))
+    cpus_per_job = max(1, cpus // jobs)
+    print(f"\nRunning {len(tasks)} InterProScan job(s), {jobs} at a time with {cpus_per_job} cpu(s) each ({cpus} cpus total).\n")
+
+    results = []
+    batch_start = time.time()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(run_interproscan_job, interpro_path, task, cpus_per_job, manifest_path, manifest) for task in tasks]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            remaining = len(tasks) - len(results)
+            running = min(jobs, remaining)
+            status = "finished" if result["returncode"] == 0 else f"FAILED (exit {result['returncode']})"
+            print(f"[{len(results)}/{len(tasks)} done | {running} running | {remaining - running} queued] "
+                  f"{result['name']} {status} in {format_elapsed(result['elapsed'])}")
+
+    failed = [result["name"] for result in results if result["returncode"] != 0]
+    print("-"*50)
+    print(f"\nAll jobs completed in {format_elapsed(time.time() - batch_start)}: {len(results) - len(failed)} succeeded, {len(failed)} failed.")
+    for name in failed:
+        print(f"\tfailed: {name}")
+    return results
+
+
+def run_interproscan_job(interpro_path, task, cpus, manifest_path=None, manifest=None):
+    """
+    Run a single interproscan job with its own output and temp dir,
+    interproscan's console output is written to a log file in the output dir
+
+    """
+    os.makedirs(task["out_dir"], exist_ok=True)
+    command = [interpro_path, "-i", task["input"], "-d", task["out_dir"], "-tempdir", task["temp_dir"], "-cpu", str(cpus)]
+    log_path = os.path.join(task["out_dir"], "interproscan.log")
+    print(f"Starting {task['name']}: {' '.join(command)}")
+    # a job that is still "running" in the manifest on the next run was interrupted
+    with MANIFEST_LOCK:
+        task["entry"].update({"status": "running", "checksum": task["checksum"], "command": command, "tsv": task["tsv"], "updated": timestamp()})
+        task["entry"].pop("returncode", None)
+    if manifest:
+        save_manifest(manifest, manifest_path)
+    start = time.time()
+    try:
+        with open(log_path, "w") as log_file:
+            returncode = subprocess.run(command, stdout=log_file, stderr=subprocess.STDOUT).returncode
+    except OSError as e:
+        print(f"There was an error running InterProScan on {task['name']}.")
+        print(e)
+        returncode = -1
+    elapsed = time.time() - start
+    # remove the temp dir of this job once it is done
+    shutil.rmtree(task["temp_dir"], ignore_errors=True)
+    if returncode == 0 and not os.path.exists(task["tsv"]):
+        print(f"InterProScan exited without writing {task['tsv']}")
+        returncode = -1
+    with MANIFEST_LOCK:
+        task["entry"].update({"status": "done" if returncode == 0 else "failed", "returncode": returncode, "elapsed": round(elapsed, 1), "updated": timestamp()})
+        if returncode == 0:
+            task["entry"]["tsv_size"] = os.path.getsize(task["tsv"])
+    if manifest:
+        save_manifest(manifest, manifest_path)
+    return {"name": task["name"], "task": task, "command": command, "returncode": returncode, "elapsed": elapsed, "log": log_path}
+
+
+def format_elapsed(seconds):
+    """
+    format a number of seconds as h:mm:ss
+
+    """
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+def timestamp():
+    """
+    current local time for the manifest
+
+    """
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             
 
 if __name__ == "__main__":
@@ -50,12 +721,24 @@ if __name__ == "__main__":
     parser.add_argument("--prefix", help="Prefix to filter the aa.fasta files (e.g. PA-, KA-, Phage-).")
     parser.add_argument("--output_folder", help="Path to the output folder where results will be saved.")
     parser.add_argument("--interpro_path", help="path to the interproscan.sh script", default=None)
+    parser.add_argument("--cpus", type=int, default=None, help="Total number of cpus shared by all running InterProScan jobs (default: all cpus).")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of InterProScan jobs to run at once (default: 1).")
+    parser.add_argument("--shard_size", type=int, default=0, help="Split each proteome into shards of this many proteins that run as separate jobs (default: 0, no sharding).")
+    parser.add_argument("--retries", type=int, default=1, help="Number of times to retry failed jobs/shards in the same run (default: 1).")
+    parser.add_argument("--cache", default=None, help="Path to a protein md5 result cache file (created if missing); only proteins not in the cache are sent to InterProScan.")
+    parser.add_argument("--cache_size_mb", type=int, default=1024, help="Maximum size of the result cache in MB, least recently used proteins are removed above it (default: 1024).")
+    parser.add_argument("--cluster_identity", type=float, default=None, help="Cluster the proteins of all genomes at this identity (e.g. 0.95, 1.0 for exact duplicates only) and only scan one representative per cluster.")
+    parser.add_argument("--status", action="store_true", help="Only print a summary of the run manifest in <output_folder>/<prefix> (needs --output_folder and --prefix), nothing is run.")
+    args = parser.parse_args()
+
+    if args.status and args.output_folder is not None and args.prefix is not None:
+        print_manifest_status(args.output_folder, args.prefix)
+        sys.exit(0)
     # if all 4 arguments are not provided, print help message
-    if len(sys.argv) < 9:
+    # (an empty --prefix is allowed, it matches every aa.fasta)
+    if any(arg is None for arg in [args.input_folder, args.prefix, args.output_folder, args.interpro_path]):
         parser.print_help(sys.stderr)
         print("\n")
         sys.exit(1)
-    args = parser.parse_args()
-
-    run_interproscan_batch(args.input_folder, args.prefix, args.output_folder, args.interpro_path)
 
+    run_interproscan_batch(args.input_folder, args.prefix, args.output_folder, args.interpro_path, args.cpus, args.jobs, args.shard_size, args.retries, args.cache, args.cache_size_mb, args.cluster_identity)
@@ -0,0 +1,198 @@
+from Bio import SeqIO # type: ignore
+import argparse
+import os
+import sys
+import io
+import contextlib
+import traceback
+import concurrent.futures
+from collections import Counter
+# the combine, colour and export steps are imported from their folders in this repository
+REPO_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+for step_folder in ["combineSPHAEinterpro_script", "add_color_notes", "create_faa_ffn_from_gbk"]:
+    sys.path.insert(0, os.path.join(REPO_FOLDER, step_folder))
+from combineSPHAEinterpro import (index_interpro_results, print_ambiguous_results, print_batch_summary, reduce_interpro_tsv, # type: ignore
+                                  select_top_hits_columnar, count_cds_annotation, add_interpro_annotation, write_summary_file, write_tophits_tsv)
+from add_color_notes_recurs import order_color_gbk_quals, print_function_report # type: ignore
+from export_from_gbk import cds_fasta_header, format_fasta, WRITE_BUFFER # type: ignore
+
+"""
+Post-SPHAE pipeline: reads each SPHAE .gbk once and, in the same pass, adds the InterProScan
+results (combineSPHAEinterpro.py), the colours and notes (add_color_notes_recurs.py) and writes
+the final .gbk, the .faa (create_faa_from_gbk.py), the summary and the top InterProScan hits .tsv
+
+"""
+
+
+def run_pipeline(interpro_folder, prefix, SPHAE_folder, output_folder, engine="stream", workers=1, intermediate=False, verbose=False):
+    """
+    main function: runs the pipeline for every genome folder in the SPHAE folder.
+    with workers > 1 the genomes are processed in a pool of worker processes,
+    and the output of each genome is printed as one block when it finishes
+
+    """
+    print("\n"+"-"* 60)
+    print(" ")
+    output_subfolder = os.path.join(output_folder, f"{prefix}_combined")
+    os.makedirs(output_subfolder, exist_ok=True)
+
+    folders = os.listdir(SPHAE_folder)
+    # find the InterProScan results of all genomes with one scan of the results folder
+    interpro_paths, ambiguous = index_interpro_results(interpro_folder, folders)
+    print_ambiguous_results(interpro_paths, ambiguous)
+    results = []
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(run_pipeline_genome, folder, interpro_paths.get(folder), SPHAE_folder, output_subfolder, engine, intermediate, verbose, True): folder for folder in folders}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as error: # the worker process itself died
+                    result = {"genome": futures[future], "status": "failed", "log": f"\nError while processing {futures[future]}: {error!r}\n"}
+                print(result.pop("log"), end="", flush=True)
+                results.append(result)
+    else:
+        for folder in folders:
+            result = run_pipeline_genome(folder, interpro_paths.get(folder), SPHAE_folder, output_subfolder, engine, intermediate, verbose)
+            result.pop("log")
+            results.append(result)
+    print_batch_summary(results)
+    print_function_report([result for result in results if result["status"] == "done"])
+
+
+def run_pipeline_genome(folder, interpro_path, SPHAE_folder, output_subfolder, engine, intermediate, verbose, capture_log=False):
+    """
+    runs pipeline_genome for one genome and catches any error, so one genome can not stop the batch.
+    with capture_log the printed output is returned in result["log"] instead of printed
+
+    """
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log) if capture_log else contextlib.nullcontext():
+        try:
+            result = pipeline_genome(folder, interpro_path, SPHAE_folder, output_subfolder, engine, intermediate, verbose)
+        except Exception:
+            print(f"\nError while processing {folder}:\n{traceback.format_exc()}")
+            print("#@*"* 45 + '\n')
+            result = {"genome": folder, "status": "failed"}
+    result["log"] = log.getvalue()
+    return result
+
+
+def pipeline_genome(folder, interpro_path, SPHAE_folder, output_subfolder, engine, intermediate=False, verbose=False):
+    """
+    writes the final outputs of one genome folder to <output_subfolder>/<folder>/:
+        <folder>_colour.gbk                    SPHAE .gbk with the InterProScan products, notes and colours
+        <folder>_colour.faa                    protein sequences of the final .gbk
+        <folder>_NEW_summary.txt               same as combineSPHAEinterpro.py
+        <folder>_NEW_top_interpro_hits.tsv     same as combineSPHAEinterpro.py
+        <folder>_NEW.gbk                       only with intermediate, the .gbk before colouring
+    returns a dictionary with the status, CDS counts and function types of the genome
+
+    """
+    gbk_path = os.path.join(SPHAE_folder, folder, f"{folder}.gbk")
+    if not os.path.exists(gbk_path):
+        print(f"\nGenBank file not found: {gbk_path}\n")
+        print("#@*"* 45 + '\n')
+        return {"genome": folder, "status": "skipped (no .gbk)"}
+    if not interpro_path:
+        print(f"No InterProScan results found for {folder}. Skipping.")
+        print("-"* 50)
+        return {"genome": folder, "status": "skipped (no InterProScan .tsv)"}
+    print(f"Processing GenBank file: {gbk_path}")
+    print(f"Processing InterProScan results: {interpro_path}")
+
+    # select most specific hits for each locus with the lowest e-value
+    if engine == "pandas":
+        line_count, interpro_prod_lib, interpro_evalue_lib = select_top_hits_columnar(interpro_path)
+    else:
+        line_count, interpro_prod_lib, interpro_evalue_lib = reduce_interpro_tsv(interpro_path)
+    print(f"Found {line_count} lines in InterProScan results for {folder}.")
+
+    phage_results_subfolder = os.path.join(output_subfolder, folder)
+    os.makedirs(phage_results_subfolder, exist_ok=True)
+    outputs = {"gbk": os.path.join(phage_results_subfolder, f"{folder}_colour.gbk"), "faa": os.path.join(phage_results_subfolder, f"{folder}_colour.faa")}
+    if intermediate:
+        outputs["new_gbk"] = os.path.join(phage_results_subfolder, f"{folder}_NEW.gbk")
+    notes = [] if verbose else None
+    cds_counts, interpro_hypo_SPHAE_lib, list_funcs, missing_translation = write_final_outputs(gbk_path, interpro_prod_lib, outputs, notes)
+    write_summary_file(phage_results_subfolder, folder, cds_counts, interpro_hypo_SPHAE_lib)
+    write_tophits_tsv(interpro_prod_lib, interpro_evalue_lib, phage_results_subfolder, folder)
+
+    for note in notes or []:
+        print(note)
+    for locus_tag in missing_translation:
+        print(f"No translation for CDS {locus_tag}")
+    print(f"{folder}: {cds_counts['total']} CDS, {cds_counts['interpro']} with InterProScan hits, {len(list_funcs)} coloured → {phage_results_subfolder}")
+    print("#@*"* 40 + "\n")
+    return {"genome": folder, "file": os.path.basename(outputs["gbk"]), "status": "done", "total": cds_counts["total"], "interpro": cds_counts["interpro"],
+            "SPHAE": cds_counts["SPHAE"], "new": cds_counts["new"], "hypothetical": cds_counts["hypothetical"], "funcs": Counter(list_funcs)}
+
+
+def write_final_outputs(gbk_path, interpro_prod_lib, outputs, notes=None):
+    """
+    reads the SPHAE .gbk one record at a time and, for each record, adds the InterProScan products
+    (as write_newgbk), writes the record to the intermediate .gbk if asked for, adds the notes and
+    colours of the CDS with a function (as add_color_notes_recurs.py), and writes the record to the
+    final .gbk and its proteins to the .faa (same headers as create_faa_from_gbk.py). each output is
+    written to a temporary file that replaces the output once the whole .gbk is done.
+    returns the CDS counts, the newly annotated CDS, the function types and the CDS without a translation
+
+    """
+    cds_counts, interpro_hypo_SPHAE_lib, list_funcs, missing_translation = Counter(), {}, [], []
+    temp_paths = {name: f"{path}.tmp" for name, path in outputs.items()}
+    handles = {}
+    try:
+        for name, temp_path in temp_paths.items():
+            handles[name] = open(temp_path, "w", buffering=WRITE_BUFFER)
+        for record in SeqIO.parse(gbk_path, "genbank"):
+            cds_features = [feature for feature in record.features if feature.type == "CDS"]
+            # InterProScan step
+            for feature in cds_features:
+                locus, SPHAE_product = feature.qualifiers.get("locus_tag", [""])[0], feature.qualifiers["product"][0].lower()
+                count_cds_annotation(cds_counts, interpro_hypo_SPHAE_lib, interpro_prod_lib, SPHAE_product, locus)
+                if locus in interpro_prod_lib:
+                    add_interpro_annotation(feature, interpro_prod_lib, locus)
+            if "new_gbk" in handles:
+                SeqIO.write(record, handles["new_gbk"], "genbank")
+            # colour and note step, then the proteins of the final CDS
+            for feature in cds_features:
+                if "function" in feature.qualifiers:
+                    feature.qualifiers, curr_func = order_color_gbk_quals(feature, notes)
+                    list_funcs.append(curr_func)
+                if "translation" in feature.qualifiers:
+                    cds = {"record_id": record.id, "qualifiers": feature.qualifiers}
+                    handles["faa"].write(format_fasta(cds_fasta_header(cds), feature.qualifiers["translation"][0]))
+                else:
+                    missing_translation.append(feature.qualifiers.get("locus_tag", ["NULL"])[0])
+            SeqIO.write(record, handles["gbk"], "genbank")
+        for handle in handles.values():
+            handle.close()
+        for name, temp_path in temp_paths.items():
+            os.replace(temp_path, outputs[name])
+    finally:
+        for name, handle in handles.items():
+            handle.close()
+            if os.path.exists(temp_paths[name]): # only left if the pipeline failed
+                os.remove(temp_paths[name])
+    return cds_counts, interpro_hypo_SPHAE_lib, list_funcs, missing_translation
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Combine InterProScan results with SPHAE results, add colours and notes, and write the final .gbk, .faa, summary.txt and top_interpro_hits.tsv, reading each SPHAE .gbk once.")
+
+    parser.add_argument("--interpro_folder", required= True, help="Path to the input folder containing subdirectories with interproscan .tsv files.")
+    parser.add_argument("--prefix", required= True, help="Prefix of the genomes (e.g. PA-, KA-, Phage-), the results are saved in <output_folder>/<prefix>_combined.")
+    parser.add_argument("--SPHAE_folder", required= True, help="Path to the SPHAE results folder (usually labeled 'final-annotate/' by SPHAE).")
+    parser.add_argument("--output_folder", required= True, help="Path to the output folder where results will be saved.")
+    parser.add_argument("--engine", choices=["stream", "pandas"], default="stream", help="How top InterProScan hits are selected: stream the TSV line by line (default) or use pandas grouped operations.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of genomes to process at once in separate processes (default: 1).")
+    parser.add_argument("--intermediate", action="store_true", help="Also write the <genome>_NEW.gbk with only the InterProScan results added (as combineSPHAEinterpro.py).")
+    parser.add_argument("--verbose", action="store_true", help="Print the NOTE lines of CDS that already have notes.")
+    if len(sys.argv) < 2:
+        parser.print_help(sys.stderr)
+        print("\n")
+        sys.exit(1)
+    args = parser.parse_args()
+
+    run_pipeline(args.interpro_folder, args.prefix, args.SPHAE_folder, args.output_folder, args.engine, args.workers, args.intermediate, args.verbose)
@@ -2,8 +2,11 @@ import subprocess
 import os
 import argparse 
 import sys
-from Bio import SeqIO # type: ignore
+import numpy as np # type: ignore
 from pathlib import Path
+# the shared GenBank CDS scanner is in the gbk_cds_scanner folder of this repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "gbk_cds_scanner"))
+from gbk_cds_scanner import scan_cds # type: ignore
 
 
 def retrieve_from_gbk(input_tsv, gbk1, gbk2, output_folder): 
@@ -12,23 +15,25 @@ def retrieve_from_gbk(input_tsv, gbk1, gbk2, output_folder):
     gbk1_file_name = os.path.basename(gbk1).replace(".gbk", "").replace("_colour", "").replace("_NEW", "")
     gbk2_file_name = os.path.basename(gbk2).replace(".gbk", "").replace("_colour", "").replace("_NEW", "")
 
-    with open(input_tsv, "r") as tsv_file, open(output_tsv, "w") as out_file:
-        # create a feature library for gbk1 and gbk2
-        feature_lib1 = create_feature_library(gbk1)
-        feature_lib2 = create_feature_library(gbk2)
-        # iterate through the tsv file hits
-        for index, line in enumerate(tsv_file):
-            fields = line.strip().split("\t")
-            if len(fields) < 2:
-                continue
-            query_coords = (fields[6], fields[7])
-            subject_coords = (fields[8], fields[9])
-            hit_len, pident, evalue = int(fields[3]), float(fields[2]), fields[10]
+    # create a sorted interval index for gbk1 and gbk2
+    feature_index1 = build_feature_index(create_feature_library(gbk1))
+    feature_index2 = build_feature_index(create_feature_library(gbk2))
+
+    # read all the tsv hits first so every coordinate can be resolved in one batch
+    hits = read_hits_tsv(input_tsv)
+    query_starts = locate_features(feature_index1, [int(hit["query_coords"][0]) for hit in hits])
+    query_ends = locate_features(feature_index1, [int(hit["query_coords"][1]) for hit in hits])
+    subject_starts = locate_features(feature_index2, [int(hit["subject_coords"][0]) for hit in hits])
+    subject_ends = locate_features(feature_index2, [int(hit["subject_coords"][1]) for hit in hits])
+
+    with open(output_tsv, "w") as out_file:
+        for i, hit in enumerate(hits):
+            query_coords, subject_coords = hit["query_coords"], hit["subject_coords"]
             # Retrieve sequences from gbk files
-            seq1 = retrieve_sequence_from_gbk(feature_lib1, query_coords)
-            seq2 = retrieve_sequence_from_gbk(feature_lib2, subject_coords)
+            seq1 = retrieve_sequence_from_gbk(feature_index1, query_starts[i], query_ends[i])
+            seq2 = retrieve_sequence_from_gbk(feature_index2, subject_starts[i], subject_ends[i])
             if seq1 and seq2:
-                out_file.write(f"\n******************************\nHit {index + 1}:\n\thit length: {hit_len}\n\tpercent identity: {pident}\n\tevalue: {evalue}\n******************************\n\n")
+                out_file.write(f"\n******************************\nHit {hit['index'] + 1}:\n\thit length: {hit['hit_len']}\n\tpercent identity: {hit['pident']}\n\tevalue: {hit['evalue']}\n******************************\n\n")
                 out_file.write(f"for {gbk1_file_name}: \n\tcoords: {query_coords}")
                 out_file.write(f"{seq1}\n")
                 out_file.write(f"for {gbk2_file_name}: \n\tcoords: {subject_coords}")
@@ -38,56 +43,149 @@ def retrieve_from_gbk(input_tsv, gbk1, gbk2, output_folder):
             out_file.write("-" * 50 + "\n")
 
 
+def read_hits_tsv(input_tsv):
+    """
+    reads the tblastx hits (outfmt 6) into a list of dictionaries
+
+    """
+    hits = []
+    with open(input_tsv, "r") as tsv_file:
+        for index, line in enumerate(tsv_file):
+            fields = line.strip().split("\t")
+            if len(fields) < 2:
+                continue
+            hits.append({
+                "index": index,
+                "query_coords": (fields[6], fields[7]),
+                "subject_coords": (fields[8], fields[9]),
+                "hit_len": int(fields[3]),
+                "pident": float(fields[2]),
+                "evalue": fields[10],
+            })
+    return hits
+
+
 def create_feature_library(gbk_file):
     feature_lib = {}
-    for record in SeqIO.parse(gbk_file, "genbank"):
-        for feature in record.features: 
-            if feature.type == "CDS":
-                ID = feature.qualifiers.get("locus_tag", ["unknown"])[0]
-                aa_length = len(feature.qualifiers.get("translation", [""])[0])
-                product = feature.qualifiers.get("product", ["unknown"])[0]
-                if "interpro_product" in feature.qualifiers: 
-                    product += " | " + feature.qualifiers["interpro_product"][0]
-                start = int(feature.location.start) + 1 # convert to 1-based
-                end = int(feature.location.end)
-                complement = False 
-                if feature.location.strand == -1: # handle reverse strand
-                    complement = True 
-                feature_lib[product, (start,end)] = (start, end, complement, ID, aa_length)
+    # only the CDS features and the qualifiers used here are read from the gbk
+    for cds in scan_cds(gbk_file, ["locus_tag", "translation", "product", "interpro_product"]):
+        qualifiers = cds["qualifiers"]
+        ID = qualifiers.get("locus_tag", ["unknown"])[0]
+        aa_length = len(qualifiers.get("translation", [""])[0])
+        product = qualifiers.get("product", ["unknown"])[0]
+        if "interpro_product" in qualifiers: 
+            product += " | " + qualifiers["interpro_product"][0]
+        start = cds["start"] + 1 # convert to 1-based
+        end = cds["end"]
+        complement = False 
+        if cds["strand"] == -1: # handle reverse strand
+            complement = True 
+        # a CDS across the origin spans the whole genome, it is looked up by its parts instead
+        parts = [(part[0] + 1, part[1]) for part in cds["parts"]] if wraps_origin(cds["parts"]) else None
+        feature_lib[product, (start,end)] = (start, end, complement, ID, aa_length, parts)
     return feature_lib
 
 
-def retrieve_sequence_from_gbk(gbk_lib, coords):
+def wraps_origin(parts):
+    """
+    True if the (0-based start, end, strand) parts of a CDS location go back to the start of
+    the genome, e.g. join(49001..50000,1..500) or complement(join(490883..490885,1..879))
+
+    """
+    if len(parts) < 2:
+        return False
+    part_starts = [part[0] for part in parts]
+    if parts[0][2] == -1: # complement parts are listed from the last to the first
+        part_starts.reverse()
+    return any(next_start < part_start for part_start, next_start in zip(part_starts, part_starts[1:]))
+
+
+def build_feature_index(feature_lib):
+    """
+    turns the feature library into a sorted, array-backed interval index 
+    (parallel arrays ordered by CDS start). positions are looked up in the lookup_* arrays: one
+    interval per CDS, or one per part for a CDS across the origin, with the CDS it belongs to
+
+    """
+    entries = sorted(
+        ((start, end, complement, ID, aa_length, feature[0], parts) for feature, (start, end, complement, ID, aa_length, parts) in feature_lib.items()),
+        key=lambda x: (x[0], x[1]),
+    )
+    starts = np.array([e[0] for e in entries], dtype=np.int64)
+    ends = np.array([e[1] for e in entries], dtype=np.int64)
+    intervals = sorted((part_start, part_end, i) for i, e in enumerate(entries) for part_start, part_end in (e[6] or [(e[0], e[1])]))
+    lookup_starts = np.array([interval[0] for interval in intervals], dtype=np.int64)
+    lookup_ends = np.array([interval[1] for interval in intervals], dtype=np.int64)
+    feature_index = {
+        "starts": starts,
+        "ends": ends,
+        "complement": np.array([e[2] for e in entries], dtype=bool),
+        "ID": [e[3] for e in entries],
+        "aa_length": [e[4] for e in entries],
+        "product": [e[5] for e in entries],
+        "lookup_starts": lookup_starts,
+        "lookup_ends": lookup_ends,
+        "lookup_feature": np.array([interval[2] for interval in intervals], dtype=np.int64),
+        # the longest interval bounds how far back from a position an overlapping CDS can start
+        # (CDS across the origin only add their parts, so they do not widen it to the genome length)
+        "max_span": int((lookup_ends - lookup_starts).max()) if len(intervals) else 0,
+    }
+    return feature_index
+
+
+def locate_features(feature_index, positions):
+    """
+    finds every CDS that contains each position in one vectorized batch. 
+    returns a list (one entry per position) of index lists into feature_index
+
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    starts, ends = feature_index["lookup_starts"], feature_index["lookup_ends"]
+    if len(positions) == 0 or len(starts) == 0:
+        return [[] for _ in range(len(positions))]
+    # only CDS with start in [pos - max_span, pos] can contain pos
+    hi = np.searchsorted(starts, positions, side="right")
+    lo = np.searchsorted(starts, positions - feature_index["max_span"], side="left")
+    counts = hi - lo
+    # expand every (position, candidate CDS) pair and keep the ones where the CDS also ends after pos
+    pos_idx = np.repeat(np.arange(len(positions)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cand_idx = np.repeat(lo, counts) + offsets
+    keep = ends[cand_idx] >= positions[pos_idx]
+    pos_idx, feature_idx = pos_idx[keep], feature_index["lookup_feature"][cand_idx[keep]]
+    # split the matches back into one list per position (pos_idx is already grouped), in CDS order
+    bounds = np.searchsorted(pos_idx, np.arange(len(positions) + 1))
+    return [sorted(set(feature_idx[bounds[i]:bounds[i + 1]].tolist())) for i in range(len(positions))]
+
+
+def format_feature(feature_index, i):
+    """
+    formats one CDS from the feature index for the summary output
+
+    """
+    return (f"\n\t{feature_index['product'][i]} \n\tlength: {feature_index['aa_length'][i]} "
+            f"\n\t{feature_index['starts'][i]}-{feature_index['ends'][i]} "
+            f"\n\t{'complement' if feature_index['complement'][i] else 'forward'} \n\t{feature_index['ID'][i]}")
+
+
+def retrieve_sequence_from_gbk(feature_index, start_hits, end_hits):
+    """
+    builds the output message for a hit from the CDS it started and ended in 
+    (every overlapping CDS is reported)
+
+    """
+    if not start_hits or not end_hits:
+        return None
     out_message = ""
-    start_save = []
-    end_save = []
-    hit_loc_start = []
-    hit_loc_end = []
-    for feature, (start, end, complement, ID, aa_length) in gbk_lib.items(): 
-        if int(coords[0]) >= start and int(coords[0]) <= end:
-            hit_loc_start.append(ID)
-            start_save.append(feature[0])
-            start_save.append((start, end))
-            start_save.append("complement" if complement else "forward")
-            start_save.append(ID)
-            start_save.append(aa_length)
-        #  out_message += f"\nhit started in\n\t {feature[0]} \n\t{start}-{end} \n\t{'complement' if complement else 'forward'} \n\t{ID}"
-        if int(coords[1]) >= start and int(coords[1]) <= end:
-            hit_loc_end.append(ID)
-            end_save.append(feature[0])
-            end_save.append((start, end))
-            end_save.append("complement" if complement else "forward")
-            end_save.append(ID)
-            end_save.append(aa_length)
-        #  out_message += f"\nhit ended in\n\t {feature[0]} \n\t{start}-{end} \n\t{'complement' if complement else 'forward'} \n\t{ID}\n"
-    # right now this ONLY DISPLAYS THE FIRST HIT START AND END, even if multiple
-    # can expand on later if needed
-    if hit_loc_start == hit_loc_end and hit_loc_start != []:
-        out_message += f"\nhit started and ended in \n\t{start_save[0]} \n\tlength: {start_save[4]} \n\t{start_save[1][0]}-{start_save[1][1]} \n\t{start_save[2]} \n\t{start_save[3]}\n"
+    if start_hits == end_hits:
+        out_message += "\nhit started and ended in "
+        out_message += "".join(format_feature(feature_index, i) for i in start_hits) + "\n"
     else: 
-        out_message += f"\nhit started in \n\t{start_save[0]} \n\tlength: {start_save[4]} \n\t{start_save[1][0]}-{start_save[1][1]} \n\t{start_save[2]} \n\t{start_save[3]}"
-        out_message += f"\nhit ended in \n\t{end_save[0]} \n\tlength: {end_save[4]} \n\t{end_save[1][0]}-{end_save[1][1]} \n\t{end_save[2]} \n\t{end_save[3]}\n"  
-    return out_message if out_message else None
+        out_message += "\nhit started in "
+        out_message += "".join(format_feature(feature_index, i) for i in start_hits)
+        out_message += "\nhit ended in "
+        out_message += "".join(format_feature(feature_index, i) for i in end_hits) + "\n"
+    return out_message
 
 
 